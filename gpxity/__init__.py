@@ -14,13 +14,14 @@ from .lifetrack import *
 from .backend import *
 from .diff import *
 from .locate import *
+from .geocache import *
 from .backends import *
 from .version import *
 
 __all__ = [
     'Gpx', 'GpxFile', 'Fences', 'Lifetrack', 'Locate', 'Directory', 'GPSIES', 'MMT', 'TrackMMT', 'Openrunner',
     'BackendDiff', 'WPTrackserver', 'Mailer', 'VERSION', 'Account', 'DirectoryAccount',
-    'Memory', 'MemoryAccount']
+    'Memory', 'MemoryAccount', 'GeoCache']
 
 
 def prepare_backends():
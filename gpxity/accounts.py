@@ -12,8 +12,11 @@ import os
 import re
 import copy
 import tempfile
+from math import cos, radians, pi
 
-from gpxpy.geo import Location
+import numpy
+
+from gpxpy.geo import Location, ONE_DEGREE
 
 __all__ = ['Fences', 'Account', 'DirectoryAccount', 'MemoryAccount']
 
@@ -23,6 +26,11 @@ class Fences:  # pylint: disable=too-few-public-methods
     """
     Defines circles.
 
+    Every circle also gets a bounding box in degrees. Points outside of it
+    are outside of the circle for gpxpy distance_2d, both for the flat
+    earth formula and for haversine. So the exact distance is only
+    computed for points within the bounding box.
+
     Args:
         config_str: The string from the accounts file
     Attributes:
@@ -48,6 +56,26 @@ class Fences:  # pylint: disable=too-few-public-methods
                     raise ValueError('Fence definition is wrong: {}'.format(fence))
                 circle = (center, radius)
                 self.circles.append(circle)
+        self.__boxes = [self.__box(*x) for x in self.circles]
+
+    @staticmethod
+    def __box(center, radius):
+        """The bounding box for a circle.
+
+        Returns: (min latitude, max latitude, longitude center, max longitude difference)
+
+        """
+        # a little more because of rounding errors
+        delta_lat = radius / ONE_DEGREE * 1.001 + 1e-9
+        min_lat = center.latitude - delta_lat
+        max_lat = center.latitude + delta_lat
+        min_cos = cos(radians(min(90.0, max(abs(min_lat), abs(max_lat)))))
+        if min_cos <= 1e-6:
+            delta_lon = 180.0
+        else:
+            # haversine is at least 2/pi of the flat earth distance on the small circle
+            delta_lon = radius / ONE_DEGREE / min_cos * pi / 2 * 1.001 + 1e-9
+        return (min_lat, max_lat, center.longitude, delta_lon)
 
     def outside(self, point) ->bool:
         """Determine if point is outside of all fences.
@@ -55,7 +83,38 @@ class Fences:  # pylint: disable=too-few-public-methods
         Returns: True or False.
 
         """
-        return all(point.distance_2d(x[0]) > x[1] for x in self.circles)
+        for (center, radius), (min_lat, max_lat, center_lon, delta_lon) in zip(self.circles, self.__boxes):
+            if not min_lat <= point.latitude <= max_lat:
+                continue
+            lon_diff = abs(point.longitude - center_lon) % 360.0
+            if min(lon_diff, 360.0 - lon_diff) > delta_lon:
+                continue
+            if point.distance_2d(center) <= radius:
+                return False
+        return True
+
+    def mask(self, points):
+        """Like :meth:`outside` for many points at once.
+
+        Args:
+            points: A list of points
+
+        Returns: A numpy array of bool, True for points outside of all fences
+
+        """
+        result = numpy.ones(len(points), dtype=bool)
+        if not self.circles or not points:
+            return result
+        latitude = numpy.fromiter((x.latitude for x in points), float, len(points))
+        longitude = numpy.fromiter((x.longitude for x in points), float, len(points))
+        for (center, radius), (min_lat, max_lat, center_lon, delta_lon) in zip(self.circles, self.__boxes):
+            lon_diff = numpy.abs(longitude - center_lon) % 360.0
+            candidates = result & (latitude >= min_lat) & (latitude <= max_lat) & (
+                numpy.minimum(lon_diff, 360.0 - lon_diff) <= delta_lon)
+            for idx in numpy.flatnonzero(candidates):
+                if points[idx].distance_2d(center) <= radius:
+                    result[idx] = False
+        return result
 
     def __str__(self):  # noqa
         return self.string
@@ -200,6 +259,10 @@ class Account:
             You can define any number of fences separated by spaces. Every fence is a circle.
             It has the form Lat/Long/meter.
             Lat and Long are the center position in decimal degrees, meter is the radius.
+        prefetch: The number of gpxfiles :meth:`Backend.prefetch() <gpxity.backend.Backend.prefetch>`
+            loads in parallel.
+        listpages: The number of pages requested in parallel while listing the
+            gpxfiles of backends like :class:`~gpxity.backends.mmt.MMT`
 
     """
 
@@ -9,15 +9,21 @@
 # pylint: disable=protected-access
 
 import datetime
+import heapq
+from collections import defaultdict
 from inspect import getmembers, isfunction
 from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 import logging
 from copy import deepcopy
 
+import numpy
+
 from .accounts import Account
 from .gpxfile import GpxFile
 from .util import collect_gpxfiles
 from .gpx import Gpx
+from .columns import BoundsIndex
 
 from .backend_base import BackendBase
 __all__ = ['Backend']
@@ -81,6 +87,8 @@ class Backend(BackendBase):
             That is the digits after the decimal separator.
         supported_categories: The categories supported by this backend. The first one is used as default.
         accepts_zero_points: True if the Backend accepts a GpxFile without Points
+        max_prefetch_workers: The upper limit for parallel loads in :meth:`prefetch`.
+        max_list_pages: The upper limit for pages requested in parallel while listing.
 
     """
 
@@ -97,6 +105,10 @@ class Backend(BackendBase):
 
     max_field_sizes = {}
 
+    max_prefetch_workers = 4
+
+    max_list_pages = 4
+
     _category_decoding = dict()
     _category_encoding = dict()
 
@@ -134,7 +146,11 @@ class Backend(BackendBase):
         if 'backend' not in self.account.config:
             self.account.config['backend'] = self.__class__.__name__
         self._decoupled = False
-        self.__gpxfiles = list()
+        self.__gpxfiles = dict()  # id(gpxfile): gpxfile, in the order they were appended
+        self.__by_ident = dict()  # id_in_backend: gpxfile
+        self.__ordered = None  # list(self.__gpxfiles.values()), built when needed
+        self.__similarity_fingerprints = dict()  # id(gpxfile): fingerprint, see most_similar
+        self.__similarity_cells = defaultdict(set)  # rounded position: set(id(gpxfile))
         self._gpxfiles_fully_listed = False
         self.__match = None
         self.logger = logging.getLogger(str(self))
@@ -392,12 +408,12 @@ class Backend(BackendBase):
         """
         if not self._gpxfiles_fully_listed and not self._decoupled:
             self._gpxfiles_fully_listed = True
-            unsaved = [x for x in self.__gpxfiles if not x.id_in_backend]
+            unsaved = [x for x in self.__gpxfiles.values() if not x.id_in_backend]
             if self.__match is not None:
                 for gpxfile in unsaved:
                     # side effect: raises exception if no match
                     self.matches(gpxfile, 'scan')
-            self.__gpxfiles = unsaved
+            self.__set_gpxfiles(unsaved)
             if 'scan' in self.supported:
                 match_function = self.__match
                 self.__match = None
@@ -410,7 +426,40 @@ class Backend(BackendBase):
                 finally:
                     self.__match = match_function
             if self.__match is not None:
-                self.__gpxfiles = [x for x in self.__gpxfiles if self.matches(x)]
+                self.__set_gpxfiles(x for x in self.__gpxfiles.values() if self.matches(x))
+
+    def __set_gpxfiles(self, gpxfiles):
+        """Replace the list of gpxfiles."""
+        self.__gpxfiles = {id(x): x for x in gpxfiles}
+        self.__by_ident = {x.id_in_backend: x for x in self.__gpxfiles.values() if x.id_in_backend is not None}
+        self.__ordered = None
+
+    def __ordered_gpxfiles(self):
+        """The gpxfiles in the order they were appended.
+
+        The list is kept until the gpxfiles change, callers must not change it.
+
+        Returns: The list
+
+        """
+        if self.__ordered is None:
+            self.__ordered = list(self.__gpxfiles.values())
+        return self.__ordered
+
+    def __discard(self, gpxfile):
+        """Remove gpxfile from the list of gpxfiles if it is there."""
+        if self.__gpxfiles.pop(id(gpxfile), None) is not None:
+            self.__ordered = None
+            if self.__by_ident.get(gpxfile.id_in_backend) is gpxfile:
+                del self.__by_ident[gpxfile.id_in_backend]
+
+    def _ident_changed(self, gpxfile, old_ident: str):
+        """Called by GpxFile when its id_in_backend changes."""
+        if id(gpxfile) in self.__gpxfiles:
+            if self.__by_ident.get(old_ident) is gpxfile:
+                del self.__by_ident[old_ident]
+            if gpxfile.id_in_backend is not None:
+                self.__by_ident[gpxfile.id_in_backend] = gpxfile
 
     def _found_gpxfile(self, ident: str, gpx):
         """Create an empty gpxfile for ident and insert it into this backend.
@@ -439,15 +488,95 @@ class Backend(BackendBase):
         with self._decouple():
             self._read(gpxfile)
             gpxfile.gpx.default_country = self.account.country
-            points_read = gpxfile.gpx.get_track_points_no()
-            with gpxfile.fenced():
-                fenced_points = gpxfile.gpx.get_track_points_no()
-            gpxfile._illegal_points = points_read - fenced_points
+            gpxfile._illegal_points = gpxfile.gpx.fenced_points(self.account.fences)
 
     def _read(self, gpxfile) ->None:
         """fill the gpxfile with all its data from source."""
         raise NotImplementedError()
 
+    def prefetch(self, gpxfiles=None, workers: int = None) ->None:
+        """Fully load gpxfiles in parallel.
+
+        Normally a gpxfile which has only been listed is loaded when it is
+        first needed, one at a time. This loads them in a thread pool.
+
+        Args:
+            gpxfiles: The gpxfiles to load. Default is all gpxfiles in this backend.
+                Gpxfiles living in other backends or already loaded are ignored.
+            workers: The maximum number of parallel loads. Default is
+                the value of prefetch in the account, or :attr:`max_prefetch_workers`.
+                :attr:`max_prefetch_workers` is also the upper limit.
+
+        """
+        if gpxfiles is None:
+            gpxfiles = list(self)
+        todo = [x for x in gpxfiles if x.backend is self and x._needs_load_full()]
+        if not todo:
+            return
+        if workers is None:
+            workers = int(self.account.prefetch or self.max_prefetch_workers)
+        workers = max(1, min(workers, self.max_prefetch_workers, len(todo)))
+        # Decouple once for all threads: a nested _decouple() in a worker then
+        # always saves and restores True, so the workers cannot disturb each other.
+        with self._decouple():
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for _ in executor.map(self._read_all_decoupled, todo):
+                    pass
+
+    def _list_pages(self) ->int:
+        """How many pages may be requested in parallel while listing.
+
+        Returns: The value of listpages in the account or :attr:`max_list_pages`,
+            limited by :attr:`max_list_pages`
+
+        """
+        return max(1, min(int(self.account.listpages or self.max_list_pages), self.max_list_pages))
+
+    def _fetch_pages(self, fetch, pages):
+        """Fetch pages in parallel, see :meth:`_list_pages`.
+
+        Args:
+            fetch: A function getting a page
+            pages: The arguments for fetch
+
+        Yields:
+            The results of fetch, in the order of pages
+
+        """
+        pages = list(pages)
+        workers = min(self._list_pages(), len(pages))
+        if workers <= 1:
+            yield from map(fetch, pages)
+            return
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            yield from executor.map(fetch, pages)
+
+    def _fetch_open_pages(self, fetch, start: int, step: int):
+        """Fetch pages with offsets start, start + step, ... in parallel, see :meth:`_list_pages`.
+
+        Use this if the number of pages is not known in advance. Requesting stops after
+        the first empty page. A few requests beyond the end are made and thrown away,
+        so only use this if the caller knows there are more pages.
+
+        Args:
+            fetch: A function getting the items of the page at an offset
+            start: The offset of the first page
+            step: The page size
+
+        Yields:
+            The pages in order, up to the last one having items
+
+        """
+        offset = start
+        while True:
+            window = self._list_pages()
+            pages = list(self._fetch_pages(fetch, range(offset, offset + window * step, step)))
+            for page in pages:
+                if not page:
+                    return
+                yield page
+            offset += window * step
+
     def matches(self, gpxfile, exc_prefix: str = None):
         """match gpxfile against the current match function.
 
@@ -528,7 +657,7 @@ class Backend(BackendBase):
                 except ValueError:
                     pass
         else:
-            if any(x is gpxfile for x in self.__gpxfiles):
+            if id(gpxfile) in self.__gpxfiles:
                 raise ValueError(
                     'Already in list: GpxFile {} with id={}, have={}'.format(
                         gpxfile, id(gpxfile), ','.join(str(x) for x in self)))
@@ -547,7 +676,7 @@ class Backend(BackendBase):
             # only hold the first uploaded gpxfile, and remove would remove that
             # instance instead of this one.
             # TODO: do we have a unittest for that case?
-            self.__gpxfiles = [x for x in self.__gpxfiles if x is not new_gpxfile]
+            self.__discard(new_gpxfile)
             with self._decouple():
                 new_gpxfile.id_in_backend = None
                 new_gpxfile._set_backend(None)
@@ -624,11 +753,8 @@ class Backend(BackendBase):
             self._remove_ident(gpxfile.id_in_backend)
         with self._decouple():
             gpxfile.gpx.is_complete = True  # we do not care about partially loaded GpxFile when deleting it
+            self.__discard(self.__by_ident.get(gpxfile.id_in_backend, gpxfile))
             gpxfile._set_backend(None)
-            try:
-                self.__gpxfiles = [x for x in self.__gpxfiles if x.id_in_backend != gpxfile.id_in_backend]
-            except ValueError:
-                pass
 
     def _remove_ident(self, ident: str) ->None:
         """backend dependent implementation."""
@@ -709,11 +835,9 @@ class Backend(BackendBase):
             True if we have the item
 
         """
-        if hasattr(index, 'id_in_backend') and index in self.__gpxfiles:
-            return True
-        if isinstance(index, str) and index in [x.id_in_backend for x in self.__gpxfiles]:
-            return True
-        return False
+        if hasattr(index, 'id_in_backend'):
+            return id(index) in self.__gpxfiles
+        return isinstance(index, str) and index in self.__by_ident
 
     def __getitem__(self, index):
         """Allow accesses like alist[a_id].
@@ -728,10 +852,12 @@ class Backend(BackendBase):
         """
         self._scan()
         if isinstance(index, int):
-            return self.__gpxfiles[index]
-        for _ in self.__gpxfiles:
-            if _ is index or _.id_in_backend == index:
-                return _
+            return self.__ordered_gpxfiles()[index]
+        if hasattr(index, 'id_in_backend'):
+            if id(index) in self.__gpxfiles:
+                return index
+        elif index in self.__by_ident:
+            return self.__by_ident[index]
         raise IndexError
 
     def __len__(self) ->int:
@@ -756,21 +882,21 @@ class Backend(BackendBase):
         """Append a gpxfile to the cached list."""
         if gpxfile.id_in_backend is not None and not isinstance(gpxfile.id_in_backend, str):
             raise Exception('{}: id_in_backend must be str'.format(gpxfile))
-        tracks_with_this_id = [x for x in self.__gpxfiles if x.id_in_backend == gpxfile.id_in_backend]
-        if tracks_with_this_id:
-            assert len(tracks_with_this_id) == 1
-            track_with_this_id = tracks_with_this_id[0]
+        track_with_this_id = self.__by_ident.get(gpxfile.id_in_backend)
+        if track_with_this_id is not None:
             if not track_with_this_id.backend:
                 # we actually replace the unsaved gpxfile with the new one
-                del self.__gpxfiles[track_with_this_id]
-        if gpxfile.id_in_backend is not None and any(
-                x.id_in_backend == gpxfile.id_in_backend for x in self.__gpxfiles):
-            # cannot do "in self" because we are not decoupled, so that would call _scan()
-            raise ValueError(
-                'Backend.append(gpxfile {}): its id_in_backend {} is already in list: GpxFile={}, list={}'.format(
-                    str(gpxfile), gpxfile.id_in_backend, self[gpxfile.id_in_backend], self.__gpxfiles))
+                self.__discard(track_with_this_id)
+            else:
+                # cannot do "in self" because we are not decoupled, so that would call _scan()
+                raise ValueError(
+                    'Backend.append(gpxfile {}): its id_in_backend {} is already in list: GpxFile={}, list={}'.format(
+                        str(gpxfile), gpxfile.id_in_backend, track_with_this_id, list(self.__gpxfiles.values())))
         self.matches(gpxfile, 'append')
-        self.__gpxfiles.append(gpxfile)
+        self.__gpxfiles[id(gpxfile)] = gpxfile
+        self.__ordered = None
+        if gpxfile.id_in_backend is not None:
+            self.__by_ident[gpxfile.id_in_backend] = gpxfile
 
     def __repr__(self):
         """do not call len(self) because that does things.
@@ -802,7 +928,7 @@ class Backend(BackendBase):
 
         """
         self._scan()
-        return iter(self.__gpxfiles)
+        return iter(self.__ordered_gpxfiles())
 
     def __bool__(self):
         """Return True always.
@@ -843,6 +969,83 @@ class Backend(BackendBase):
                 old_gpxfile.remove()
         return result
 
+    def _fingerprint(self, gpxfile):
+        """The fingerprint of gpxfile, see :meth:`Gpx.fingerprint <gpxity.gpx.Gpx.fingerprint>`.
+
+        Backends may store it and return it without loading the gpxfile.
+
+        Returns: The fingerprint
+
+        """
+        return gpxfile.gpx.fingerprint()
+
+    def _fingerprints(self, gpxfiles):
+        """The fingerprints of many gpxfiles, see :meth:`_fingerprint`.
+
+        Returns: A list with a fingerprint for every gpxfile
+
+        """
+        return [self._fingerprint(x) for x in gpxfiles]
+
+    def __update_similarity_index(self, gpxfiles):
+        """Update the inverted index from rounded positions to gpxfiles.
+
+        Only gpxfiles with a changed fingerprint are updated.
+
+        """
+        fingerprints = self.__similarity_fingerprints
+        cells = self.__similarity_cells
+        current = dict(zip((id(x) for x in gpxfiles), self._fingerprints(gpxfiles)))
+        for key in list(fingerprints):
+            if current.get(key) is not fingerprints[key]:
+                for cell in fingerprints.pop(key)[1]:
+                    cells[cell].discard(key)
+                    if not cells[cell]:
+                        del cells[cell]
+        for key, fingerprint in current.items():
+            if key not in fingerprints:
+                fingerprints[key] = fingerprint
+                for cell in fingerprint[1]:
+                    cells[cell].add(key)
+
+    def most_similar(self, gpxfile, count: int = 10) ->list:
+        """Find the gpxfiles in this backend which are most similar to gpxfile.
+
+        See :meth:`GpxFile.similarity <gpxity.gpxfile.GpxFile.similarity>`. Only gpxfiles
+        sharing at least one position of their fingerprints are compared.
+
+        Args:
+            gpxfile: The gpxfile to compare with. It may live in a different backend.
+            count: The maximum number of results
+
+        Returns: A list of (similarity, gpxfile), the most similar first.
+
+        """
+        gpxfiles = list(self)
+        self.__update_similarity_index(gpxfiles)
+        by_id = {id(x): x for x in gpxfiles}
+        wanted = gpxfile._fingerprint()
+        candidates = set()
+        for cell in wanted[1]:
+            candidates |= self.__similarity_cells.get(cell, set())
+        candidates.discard(id(gpxfile))
+        return heapq.nlargest(
+            count,
+            ((Gpx.fingerprint_similarity(wanted, self.__similarity_fingerprints[x]), by_id[x]) for x in candidates),
+            key=lambda x: x[0])
+
+    def overlapping_times(self):
+        """Find gpxfiles in this backend with overlapping times.
+
+        See :meth:`GpxFile.overlapping_times <gpxity.gpxfile.GpxFile.overlapping_times>`.
+        If the backend lists first and last times with the headers, no gpxfile is loaded.
+
+        Yields:
+            groups of gpxfiles with overlapping times. Sorted by time.
+
+        """
+        yield from GpxFile.overlapping_times(self)
+
     def __find_mergable_groups(self, gpxfiles, partial: bool = False):
         """Find mergable groups.
 
@@ -853,15 +1056,26 @@ class Backend(BackendBase):
         result = list()
         rest = list(self)
         rest.extend(x for x in gpxfiles if str(x.backend) != str(self))
-        while rest:
-            root = rest[0]
+        # can_merge is expensive. Only ask it about pairs with compatible bounding boxes.
+        bounds = BoundsIndex([x.gpx.point_columns(fresh=True) for x in rest])
+        only_waypoints = numpy.array([not x.gpx.get_track_points_no() and bool(x.gpx.waypoints) for x in rest])
+        unused = numpy.ones(len(rest), dtype=bool)
+        for root_idx, root in enumerate(rest):
+            if not unused[root_idx]:
+                continue
+            unused[root_idx] = False
+            if partial:
+                candidates = bounds.within(root_idx) | bounds.containing(root_idx)
+            else:
+                candidates = bounds.equal(root_idx)
             group = list([root])
-            group.extend(x for x in rest[1:] if root.can_merge(x, partial)[0] is not None)  # noqa
+            for idx in numpy.flatnonzero(unused & (candidates | only_waypoints)):
+                if root.can_merge(rest[idx], partial)[0] is not None:
+                    group.append(rest[idx])
+                    unused[idx] = False
             # merge target should be the longest gpxfile in self:
             group.sort(key=lambda x: (x.backend is self, x.gpx.get_track_points_no()), reverse=True)
             result.append(group)
-            for _ in group:
-                rest = [x for x in rest if x is not _]
         return result
 
     def merge(self, other, remove: bool = False, dry_run: bool = False, copy: bool = False,
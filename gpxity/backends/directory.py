@@ -13,6 +13,9 @@ import sys
 import datetime
 import tempfile
 import logging
+import json
+import sqlite3
+import threading
 
 from collections import defaultdict
 
@@ -25,6 +28,183 @@ from ..gpx import Gpx
 __all__ = ['Directory']
 
 
+class _HeaderIndex:
+
+    """A persistent index of header values and fingerprints for all gpx files in a directory.
+
+    An entry is only valid while size, mtime and ctime of its file are unchanged.
+    ctime is needed because :meth:`Directory._write_all` sets mtime to the
+    time of the gpxfile. Values not known yet are stored as NULL.
+
+    If the index cannot be used (like in a read-only directory), it is silently
+    disabled. All methods may be called from several threads.
+
+    """
+
+    filename = '.gpxity_headers.sqlite'
+
+    def __init__(self, directory):
+        """See class docstring."""
+        self.path = os.path.join(directory, self.filename)
+        self.__db = None
+        self.__disabled = False
+        self.__lock = threading.RLock()
+
+    def __disable(self, exc):
+        """Something went wrong, do not use the index anymore."""
+        logging.warning('%s: disabling the index: %s', self.path, exc)
+        self.__disabled = True
+
+    def __execute(self, cmd, args=()):
+        """Execute an SQL command.
+
+        Returns: The cursor or None
+
+        """
+        if self.__disabled:
+            return None
+        try:
+            if self.__db is None:
+                self.__db = sqlite3.connect(self.path, check_same_thread=False)
+                self.__db.execute(
+                    'create table if not exists headers('
+                    'ident text primary key, size integer, mtime integer, ctime integer,'
+                    'title text, description text, keywords text,'
+                    'first_time text, last_time text, distance real, points integer)')
+                self.__db.execute(
+                    'create table if not exists fingerprints('
+                    'ident text primary key, size integer, mtime integer, ctime integer,'
+                    'length integer, cells text)')
+            return self.__db.execute(cmd, args)
+        except sqlite3.Error as exc:
+            self.__disable(exc)
+            return None
+
+    @staticmethod
+    def stat(path):
+        """The values making an entry valid.
+
+        Returns: A tuple
+
+        """
+        _ = os.stat(path)
+        return (_.st_size, _.st_mtime_ns, _.st_ctime_ns)
+
+    def entries(self):
+        """All entries.
+
+        Returns: A dict with ident as key and the row as value
+
+        """
+        with self.__lock:
+            cursor = self.__execute('select * from headers')
+            if cursor is None:
+                return dict()
+            return {x[0]: x for x in cursor}
+
+    @staticmethod
+    def __parse_time(value):
+        """Parse a time written by :meth:`datetime.datetime.isoformat`.
+
+        datetime.datetime.fromisoformat needs Python 3.7 and strptime only understands
+        the utc offset without colon before Python 3.7.
+
+        Returns: The datetime or None
+
+        """
+        if not value:
+            return None
+        fmt = '%Y-%m-%dT%H:%M:%S'
+        if '.' in value:
+            fmt += '.%f'
+        if value[-6] in '+-' and value[-3] == ':':
+            value = value[:-3] + value[-2:]
+            fmt += '%z'
+        return datetime.datetime.strptime(value, fmt)
+
+    def gpx(self, entry):
+        """Create a Gpx from an entry.
+
+        Returns: Gpx, the last time, the distance and the point count. The last three may be None
+
+        """
+        result = Gpx()
+        result.name, result.description, result.keywords = entry[4:7]
+        result.time = self.__parse_time(entry[7])
+        result.decode()
+        result.is_complete = False
+        return result, self.__parse_time(entry[8]), entry[9], entry[10]
+
+    def store(self, ident: str, path: str, gpx):
+        """Store what we know about gpx. If gpx is incomplete, the values depending on all points are unknown."""
+        first_time = gpx.first_time
+        values = [ident, *self.stat(path), gpx.name, gpx.description, gpx.keywords,
+                  first_time.isoformat() if first_time else None, None, None, None]
+        if gpx.is_complete:
+            last_time = gpx.last_time
+            values[8:] = [last_time.isoformat() if last_time else None, gpx.distance, gpx.get_track_points_no()]
+        with self.__lock:
+            self.__execute('insert or replace into headers values({})'.format(','.join('?' * len(values))), values)
+
+    def fingerprints(self):
+        """All stored fingerprints, see :meth:`Gpx.fingerprint <gpxity.gpx.Gpx.fingerprint>`.
+
+        Returns: A dict with ident as key and (stat, fingerprint) as value
+
+        """
+        with self.__lock:
+            cursor = self.__execute('select * from fingerprints')
+            if cursor is None:
+                return dict()
+            return {
+                x[0]: (tuple(x[1:4]), (x[4], frozenset(tuple(cell) for cell in json.loads(x[5]))))
+                for x in cursor}
+
+    def store_fingerprint(self, ident: str, stat, fingerprint):
+        """Store the fingerprint for the file with stat."""
+        values = (ident, *stat, fingerprint[0], json.dumps(sorted(fingerprint[1])))
+        with self.__lock:
+            self.__execute('insert or replace into fingerprints values(?,?,?,?,?,?)', values)
+
+    def rename(self, ident: str, new_ident: str, new_path: str):
+        """The file was renamed, which also changes its ctime."""
+        with self.__lock:
+            for table in ('headers', 'fingerprints'):
+                self.__execute(
+                    'update {} set ident=?, size=?, mtime=?, ctime=? where ident=?'.format(table),
+                    (new_ident, *self.stat(new_path), ident))
+
+    def remove(self, ident: str):
+        """Remove the entry."""
+        with self.__lock:
+            self.__execute('delete from headers where ident=?', (ident, ))
+            self.__execute('delete from fingerprints where ident=?', (ident, ))
+
+    def commit(self):
+        """Commit changes."""
+        with self.__lock:
+            if self.__db is not None and not self.__disabled:
+                try:
+                    self.__db.commit()
+                except sqlite3.Error as exc:
+                    self.__disable(exc)
+
+    def close(self, remove: bool = False):
+        """Close the database.
+
+        Args:
+            remove: Also remove the database file
+
+        """
+        with self.__lock:
+            if self.__db is not None:
+                self.commit()
+                self.__db.close()
+                self.__db = None
+        if remove and os.path.exists(self.path):
+            os.remove(self.path)
+
+
 class Directory(Backend):
 
     """Uses a directory for storage.
@@ -47,6 +227,10 @@ class Directory(Backend):
     If a gpxfile has no title, it uses a random sequence of characters.
     Changing the title also changes the id.
 
+    The header values of all gpxfiles are cached in the hidden file
+    .gpxity_headers.sqlite. So listing only has to look at files
+    which changed since they were last seen.
+
     Args:
         Account: If its url is unset, this will create a temporary
             directory named :attr:`prefix`.X where X are some random characters.
@@ -80,6 +264,8 @@ class Directory(Backend):
 
         self._symlinks = defaultdict(list)  # TODO: account.symlinks True
         self._load_symlinks()
+        self._index = _HeaderIndex(self.url)
+        self.__fingerprints = None  # ident: (stat, fingerprint)
 
     def __str__(self) ->str:
         """Used for formatting strings. Must be unique within the process.
@@ -255,23 +441,86 @@ class Directory(Backend):
         """get all gpxfiles for this user."""
         self._symlinks = defaultdict(list)
         self._load_symlinks()
+        entries = self._index.entries()
         for _ in self._list_gpx():
-            gpx = self._gpx_from_headers(_)
+            last_time = distance = point_count = None
+            path = self.gpx_path(_)
+            entry = entries.get(_)
+            if entry is not None and entry[1:4] == self._index.stat(path):
+                gpx, last_time, distance, point_count = self._index.gpx(entry)
+            else:
+                gpx = self._gpx_from_headers(_)
+                if gpx.name != Gpx.undefined_str:
+                    self._index.store(_, path, gpx)
             gpx.is_complete = False
-            self._found_gpxfile(_, gpx)
+            gpxfile = self._found_gpxfile(_, gpx)
+            if distance is not None:
+                gpxfile.distance = distance
+            if last_time is not None:
+                gpxfile.last_time = last_time
+            if point_count is not None:
+                gpxfile.point_count = point_count
+        self._index.commit()
 
     def _read(self, gpxfile):
         """fill the gpxfile with all its data from source."""
         self.dump_ids('_read', gpxfile.id_in_backend)
         read_filename = self.gpx_path(gpxfile.id_in_backend)
-        with open(read_filename, encoding='utf-8') as in_file:
+        with open(read_filename, 'rb') as in_file:
             try:
-                gpxfile.gpx = Gpx.parse(in_file.read())
+                gpxfile.gpx = Gpx.parse(in_file)
             except GPXXMLSyntaxException:
                 self.logger.error(
                     '%s cannot be parsed',
                     read_filename)
                 raise
+        self._index.store(gpxfile.id_in_backend, read_filename, gpxfile.gpx)
+        self._index.commit()
+
+    def _fingerprint(self, gpxfile):
+        """See :meth:`_fingerprints`.
+
+        Returns: The fingerprint
+
+        """
+        result = self.__fingerprint(gpxfile)
+        self._index.commit()
+        return result
+
+    def _fingerprints(self, gpxfiles):
+        """The fingerprints from the index for files which did not change.
+
+        Otherwise compute them and store them in the index.
+
+        Returns: A list with a fingerprint for every gpxfile
+
+        """
+        result = [self.__fingerprint(x) for x in gpxfiles]
+        self._index.commit()
+        return result
+
+    def __fingerprint(self, gpxfile):
+        """The fingerprint without committing the index.
+
+        Returns: The fingerprint
+
+        """
+        ident = gpxfile.id_in_backend
+        if gpxfile._dirty or ident is None:
+            return gpxfile.gpx.fingerprint()
+        if self.__fingerprints is None:
+            self.__fingerprints = self._index.fingerprints()
+        try:
+            stat = self._index.stat(self.gpx_path(ident))
+        except OSError:
+            return gpxfile.gpx.fingerprint()
+        known = self.__fingerprints.get(ident)
+        if known is not None and known[0] == stat:
+            return known[1]
+        result = gpxfile.gpx.fingerprint()
+        self.__fingerprints[ident] = (stat, result)
+        self._index.store_fingerprint(ident, stat, result)
+        return result
 
     def _remove_symlinks(self, ident: str):
         """Remove its symlinks, empty symlink parent directories."""
@@ -291,6 +540,8 @@ class Directory(Backend):
         gpx_file = self.gpx_path(ident)
         if os.path.exists(gpx_file):
             os.remove(gpx_file)
+        self._index.remove(ident)
+        self._index.commit()
 
     def _symlink_path(self, gpxfile) ->str:
         """The path for the speaking symbolic link: YYYY/MM/title.gpx.
@@ -348,6 +599,8 @@ class Directory(Backend):
         self._remove_symlinks(gpxfile.id_in_backend)
         self.logger.info('%s: renamed %s to %s', self.account, gpxfile.id_in_backend, unique_id)
         os.rename(self.gpx_path(gpxfile.id_in_backend), self.gpx_path(unique_id))
+        self._index.rename(gpxfile.id_in_backend, unique_id, self.gpx_path(unique_id))
+        self._index.commit()
         gpxfile.id_in_backend = unique_id
         self._make_symlinks(gpxfile)
 
@@ -374,6 +627,8 @@ class Directory(Backend):
         if time:
             os.utime(tmp_path, (time.timestamp(), time.timestamp()))
         os.replace(tmp_path, new_path)
+        self._index.store(new_ident, new_path, gpxfile.gpx)
+        self._index.commit()
         logging.debug('written %s', new_path)
         self.dump_ids('_write_all after os.replace', new_ident)
         return new_ident
@@ -389,6 +644,7 @@ class Directory(Backend):
     def detach(self):
         """also remove temporary directory."""
         super(Directory, self).detach()
+        self._index.close(remove=self.account.is_temporary or not any(self._list_gpx()))
         if self.account.is_temporary:
             remove_directory(self.url)
 
@@ -396,8 +396,11 @@ class GPSIES(Backend):
             time.sleep(2)
 
     def _list(self):
-        """get all gpxfiles for this user."""
-    #    return
+        """get all gpxfiles for this user.
+
+        The pages after the first one are requested in parallel.
+
+        """
         response = self.__post('trackList', data={'username': self._get_author()})
         page_parser = ParseGPSIESList()
         page_parser.feed(response.text)
@@ -405,13 +408,14 @@ class GPSIES(Backend):
         for line in response.text.split('\n'):
             if 'pagination' in line:
                 hrefs = [x for x in line.split(' ') if x.startswith('href')]
+        pages = list()
         for href in hrefs[2:-2]:
             href = href[1:-1]  # remove apostrophes
             parts = ''.join(href.split('?')[1:])
             parts = parts.split('&amp;')
-            data = dict(x.split('=') for x in parts)  # noqa
-            response = self.__post('userList', data=data)
-            page_parser.feed(response.text)
+            pages.append(dict(x.split('=') for x in parts))  # noqa
+        for text in self._fetch_pages(lambda data: self.__post('userList', data=data).text, pages):
+            page_parser.feed(text)
         for raw_data in page_parser.result['gpxfiles']:
             gpx = Gpx()
             gpx.is_complete = False
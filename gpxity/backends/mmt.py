@@ -245,6 +245,9 @@ class MMT(Backend):
 
     default_url = 'https://www.mapmytracks.com'
 
+    # get_activities returns that many activities per page. None if not known.
+    _activities_page_size = None
+
     # MMT only accepts one simultaneous lifetracker per login. We make sure
     # that at least this process does not try to run several at once.
     # This check is now too strict: We forbid multiple lifetrackers even if
@@ -584,18 +587,72 @@ class MMT(Backend):
         """
         return _convert_time(self.__post(request='get_time').find('server_time').text)
 
+    def __activities(self, author, offset):
+        """One page of get_activities.
+
+        Returns: A list of MMTRawTrack
+
+        """
+        response = self.__post(request='get_activities', author=author, offset=offset)
+        chunk = response.find('activities')
+        return [MMTRawTrack(x) for x in chunk] if chunk else []
+
+    def __activity_pages(self):
+        """All pages of get_activities.
+
+        If :attr:`_activities_page_size` is not known, the first two pages are requested
+        one after the other. Only if they have the same size, that is taken as page size.
+        If the page size is known, all pages after a full first page are requested in parallel.
+
+        Yields: Lists of MMTRawTrack
+
+        """
+        author = self._get_author()
+
+        def fetch(offset):
+            """One page.
+
+            Returns: A list of MMTRawTrack
+
+            """
+            return self.__activities(author, offset)
+
+        first = fetch(0)
+        if not first:
+            return
+        yield first
+        page_size = self._activities_page_size
+        if page_size is None:
+            second = fetch(len(first))
+            if not second:
+                return
+            yield second
+            if len(second) != len(first):
+                # no page size known, continue one page after the other
+                offset = len(first) + len(second)
+                while True:
+                    page = fetch(offset)
+                    if not page:
+                        return
+                    yield page
+                    offset += len(page)
+            page_size = len(first)
+            start = 2 * page_size
+        elif len(first) < page_size:
+            return
+        else:
+            start = page_size
+        yield from self._fetch_open_pages(fetch, start, page_size)
+
     def _list(self):
-        """get all gpxfiles for this user."""
-        while True:
+        """get all gpxfiles for this user.
+
+        Pages are requested in parallel where possible, see :meth:`__activity_pages`.
+
+        """
+        for chunk in self.__activity_pages():
             old_len = self.real_len()
-            response = self.__post(
-                request='get_activities', author=self._get_author(),
-                offset=old_len)
-            chunk = response.find('activities')
-            if not chunk:
-                return
-            for _ in chunk:
-                raw_data = MMTRawTrack(_)
+            for raw_data in chunk:
                 gpx = Gpx()
                 gpx.is_complete = False
                 gpx.name = raw_data.title
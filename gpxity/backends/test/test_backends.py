@@ -12,11 +12,16 @@ import time
 import datetime
 import random
 import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs
 
 from unittest import skipIf
 
 from .basic import BasicTest, disabled
 from .. import Memory, Directory, MMT, GPSIES, TrackMMT, Mailer, WPTrackserver, Openrunner
+from ..wptrackserver import ConnectionPool
 from ... import GpxFile, Lifetrack, Backend, Account, MemoryAccount, DirectoryAccount, Fences
 from ...util import remove_directory
 
@@ -559,6 +564,61 @@ class TestBackends(BasicTest):
                                         if uplink.accepts_zero_points:
                                             self.assertSameTracks(local_serverdirectory, uplink)
 
+    def test_lifetrack_async(self):
+        """A slow secondary target does not delay the primary one."""
+        primary = Memory()
+        secondary = Memory()
+        original_update = secondary._lifetrack_update
+
+        def slow_update(gpxfile, points):
+            time.sleep(0.2)
+            original_update(gpxfile, points)
+
+        secondary._lifetrack_update = slow_update
+        life = Lifetrack('127.0.0.1', [primary, secondary], asynchronous=True)
+        points = self._random_points(20)
+        life.start(points[:5])
+        started = time.time()
+        for idx in range(5, 20):
+            life.update_trackers(points[idx:idx + 1])
+        self.assertLess(time.time() - started, 1)
+        self.assertEqual(len(primary[life.tracker_id()].point_list()), 20)
+        self.assertGreater(life.pending(), 0)
+        life.end()
+        self.assertEqual(life.pending(), 0)
+        target = life.targets[1]
+        self.assertGreater(target.coalesced, 0)
+        self.assertLess(target.deliveries, 16)
+        self.assertTrue(secondary[target.gpxfile.id_in_backend].points_equal(primary[life.tracker_id()]))
+        self.assertIn(target.identifier(), primary[life.tracker_id()].ids)
+
+        def failing_update(gpxfile, points):
+            raise Backend.BackendException('secondary failed')
+
+        secondary._lifetrack_update = failing_update
+        life = Lifetrack('127.0.0.1', [primary, secondary])
+        life.start(points[:5])
+        with self.assertRaises(Backend.BackendException):
+            life.update_trackers(points[5:6])
+
+        third = Memory()
+        ended = list()
+        original_end = primary._lifetrack_end
+
+        def primary_end(gpxfile):
+            ended.append(gpxfile)
+            original_end(gpxfile)
+
+        primary._lifetrack_end = primary_end
+        life = Lifetrack('127.0.0.1', [primary, secondary, third], asynchronous=True)
+        life.start(points[:5])
+        life.update_trackers(points[5:10])
+        with self.assertRaises(Backend.BackendException):
+            life.end()
+        self.assertTrue(life.done)
+        self.assertEqual(len(ended), 1)
+        self.assertEqual(len(third[life.targets[2].gpxfile.id_in_backend].point_list()), 10)
+
     def test_backend_dirty(self):
         """gpxfile1._dirty."""
         for cls in Backend.all_backend_classes(needs={'scan', 'write'}):
@@ -825,3 +885,136 @@ class TestBackends(BasicTest):
                         backend.scan()
                         self.assertEqual(len(backend), 1)
                         self.assertEqual(backend[0].id_in_backend, _, 'Testing {} for {}'.format(_, cls.__name__))
+
+    def test_connection_pool(self):
+        """ConnectionPool reuses, limits and checks connections."""
+
+        class Connection:
+
+            """A stand-in for a MySQLdb connection."""
+
+            def __init__(self):
+                self.alive = True
+                self.closed = False
+
+            def ping(self):
+                """Like MySQLdb."""
+                if not self.alive:
+                    raise OSError('server has gone away')
+
+            def close(self):
+                """Like MySQLdb."""
+                self.closed = True
+
+        pool = ConnectionPool(Connection, max_connections=2)
+        first = pool.acquire()
+        second = pool.acquire()
+        self.assertEqual(pool.created, 2)
+        waited = list()
+        waiter = threading.Thread(target=lambda: waited.append(pool.acquire()))
+        waiter.start()
+        waiter.join(0.2)
+        self.assertTrue(waiter.is_alive())
+        pool.release(first)
+        waiter.join()
+        self.assertIs(waited[0], first)
+        second.alive = False
+        pool.release(second)
+        third = pool.acquire()
+        self.assertIsNot(third, second)
+        self.assertTrue(second.closed)
+        self.assertEqual(pool.created, 3)
+        pool.discard(third)
+        self.assertTrue(third.closed)
+        fourth = pool.acquire()
+        self.assertIsNot(fourth, third)
+        pool.timeout = 0.1
+        with self.assertRaises(Backend.BackendException):
+            pool.acquire()
+        pool.release(fourth)
+        self.assertIs(pool.acquire(), fourth)
+        shared = ConnectionPool.get('test', Connection)
+        self.assertIs(ConnectionPool.get('test', None), shared)
+        ConnectionPool.remove('test')
+        self.assertIs(ConnectionPool.get('test', None), shared)
+        ConnectionPool.remove('test')
+        ConnectionPool.remove('test')
+        self.assertIsNot(ConnectionPool.get('test', Connection), shared)
+        ConnectionPool.remove('test')
+
+    @skipIf(*disabled(MMT))
+    def test_mmt_list_pages(self):
+        """MMT requests the pages of get_activities in parallel and keeps their order."""
+        page_size = 3
+        delay = 0.2
+        content = {'total': 14}
+        asked = list()
+
+        class Handler(BaseHTTPRequestHandler):
+
+            """A slow stand-in for the MMT API."""
+
+            def do_POST(self):  # noqa pylint: disable=invalid-name
+                """Answer get_activities."""
+                parsed = parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode())
+                offset = int(parsed['offset'][0])
+                asked.append(offset)
+                time.sleep(delay)
+                answer = '<?xml version="1.0"?><message><activities>{}</activities></message>'.format(''.join(
+                    '<track><id>{id}</id><title>title {id}</title><activity_type>Cycling</activity_type>'
+                    '<date>{date}</date><distance>{id}.5</distance></track>'.format(id=x, date=1500000000 + x)
+                    for x in range(offset, min(offset + page_size, content['total']))))
+                self.send_response(200)
+                self.end_headers()
+                self.wfile.write(answer.encode())
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                """Be quiet."""
+
+        class Server(ThreadingMixIn, HTTPServer):
+
+            """Answers requests in parallel."""
+
+            daemon_threads = True
+
+        server = Server(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        account = Account(url='http://127.0.0.1:{}'.format(server.server_address[1]), username='gpxitytest',
+                          password='secret')
+
+        def listed(pages=None, known_page_size=None):
+            """List all gpxfiles.
+
+            Returns: The ids and the requested offsets
+
+            """
+            del asked[:]
+            account.config['listpages'] = pages
+            with MMT(account) as mmt:
+                mmt._activities_page_size = known_page_size
+                result = [x.id_in_backend for x in mmt]
+                if result:
+                    self.assertEqual(mmt[-1].distance, content['total'] - 0.5)
+            return result, sorted(asked)
+
+        try:
+            elapsed = dict()
+            for pages in (1, 4):
+                start = time.time()
+                self.assertEqual(
+                    listed(pages), ([str(x) for x in range(14)], [0, 3, 6, 9, 12, 15]))
+                elapsed[pages] = time.time() - start
+            # serial: 6 requests, parallel: two pages and then 4 pages at once
+            self.assertGreater(elapsed[1], 6 * delay)
+            self.assertLess(elapsed[4], 4 * delay)
+            self.assertEqual(listed(known_page_size=3)[1], [0, 3, 6, 9, 12, 15, 18, 21, 24])
+            content['total'] = 5
+            self.assertEqual(listed(), (['0', '1', '2', '3', '4'], [0, 3, 5]))
+            content['total'] = 2
+            self.assertEqual(listed(), (['0', '1'], [0, 2]))
+            self.assertEqual(listed(known_page_size=3), (['0', '1'], [0]))
+            content['total'] = 0
+            self.assertEqual(listed(), ([], [0]))
+        finally:
+            server.shutdown()
+            server.server_close()
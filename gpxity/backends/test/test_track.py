@@ -25,12 +25,13 @@ from unittest import skipIf
 from gpxpy import gpx as mod_gpx
 
 from .basic import BasicTest, disabled
-from ... import GpxFile, Backend, Account, DirectoryAccount
+from ... import GpxFile, Backend, Account, DirectoryAccount, BackendDiff
 from ...backend_base import BackendBase
+from ...diff import _opcodes
 from ...gpx import Gpx
 from .. import Directory, MMT, GPSIES, Mailer, TrackMMT, WPTrackserver, Memory
 from .. import Openrunner
-from ...util import repr_timespan, positions_equal, remove_directory
+from ...util import repr_timespan, positions_equal, remove_directory, add_speed
 
 # pylint: disable=attribute-defined-outside-init
 
@@ -268,6 +269,149 @@ class TrackTests(BasicTest):
                 directory.add(gpxfile)
             self.assertIsNotNone(gpxfile.backend)
 
+    @skipIf(*disabled(Directory))
+    def test_ident_lookup(self):
+        """Backend must find gpxfiles by id_in_backend after renaming."""
+        with self.temp_directory() as directory:
+            gpxfile = directory.add(self.create_test_track())
+            old_ident = gpxfile.id_in_backend
+            self.assertIs(directory[old_ident], gpxfile)
+            gpxfile.id_in_backend = 'renamed'
+            self.assertNotIn(old_ident, directory)
+            self.assertIn('renamed', directory)
+            self.assertIs(directory['renamed'], gpxfile)
+            self.assertIs(directory[0], gpxfile)
+            self.assertNotIn(gpxfile.clone(), directory)
+            second = directory.add(self.create_test_track())
+            self.assertEqual([directory[0], directory[1], directory[-1]], [gpxfile, second, second])
+            ordered = directory._Backend__ordered
+            self.assertIs(directory._Backend__ordered_gpxfiles(), ordered)
+            directory.remove('renamed')
+            self.assertNotIn('renamed', directory)
+            self.assertNotIn(gpxfile, directory)
+            self.assertIs(directory[0], second)
+            self.assertEqual(list(directory), [second])
+
+    @skipIf(*disabled(Directory))
+    def test_directory_index(self):
+        """The header index must know the gpxfiles without parsing them."""
+        with self.temp_directory() as directory:
+            gpxfile = self.create_test_track()
+            directory.add(gpxfile)
+            gpxfile.title = 'Indexed'
+            gpxfile.description = 'Index test'
+
+            def must_not_read(gpxfile):
+                raise AssertionError('{} must come from the index'.format(gpxfile))
+
+            with Directory(DirectoryAccount(directory.url)) as dir2:
+                dir2._read = must_not_read
+                gpxfile2 = dir2[gpxfile.id_in_backend]
+                self.assertEqual(gpxfile2.title, 'Indexed')
+                self.assertEqual(gpxfile2.description, 'Index test')
+                self.assertEqual(gpxfile2.distance, gpxfile.distance)
+                self.assertEqual(gpxfile2.first_time, gpxfile.first_time)
+                self.assertEqual(gpxfile2.last_time, gpxfile.last_time)
+                self.assertEqual(gpxfile2.point_count, gpxfile.point_count)
+                self.assertEqual(gpxfile2.category, gpxfile.category)
+            with open(directory.gpx_path(gpxfile.id_in_backend), 'a') as gpx_file:
+                gpx_file.write('\n')
+            with Directory(DirectoryAccount(directory.url)) as dir2:
+                gpxfile2 = dir2[gpxfile.id_in_backend]
+                self.assertEqual(gpxfile2.title, 'Indexed')
+                self.assertEqual(gpxfile2.distance, gpxfile.distance)
+
+    @skipIf(*disabled(Directory))
+    def test_prefetch(self):
+        """Load all gpxfiles in parallel."""
+        with self.temp_directory() as directory:
+            for idx in range(5):
+                directory.add(self.create_test_track(idx=idx))
+            with Directory(DirectoryAccount(directory.url, prefetch='3')) as dir2:
+                dir2.prefetch()
+                dir2._read = None  # must not be called anymore
+                for gpxfile in dir2:
+                    self.assertEqual(gpxfile, directory[gpxfile.id_in_backend])
+                    self.assertEqual(gpxfile._illegal_points, 0)
+
+    @skipIf(*disabled(Directory))
+    def test_most_similar(self):
+        """most_similar must agree with similarity and use the stored fingerprints."""
+        with self.temp_directory() as directory:
+            gpxfiles = [self.create_test_track(count=4, idx=x) for x in range(4)]
+            far = GpxFile()
+            far.add_points(self._random_points(root=GPXTrackPoint(latitude=-30, longitude=-60)))
+            gpxfiles.append(far)
+            for _ in gpxfiles:
+                directory.add(_)
+            found = directory.most_similar(gpxfiles[0], 10)
+            self.assertEqual(len(found), 3)
+            self.assertNotIn(far, [x[1] for x in found])
+            for similarity, gpxfile in found:
+                self.assertEqual(similarity, gpxfiles[0].similarity(gpxfile))
+            self.assertEqual(found[0][0], max(x[0] for x in found))
+            self.assertEqual(directory.most_similar(far), [])
+
+            def must_not_read(gpxfile):
+                raise AssertionError('{} must come from the index'.format(gpxfile))
+
+            with Directory(DirectoryAccount(directory.url)) as dir2:
+                dir2._read = must_not_read
+                found2 = dir2.most_similar(dir2[gpxfiles[0].id_in_backend])
+                self.assertEqual(
+                    sorted((x[0], x[1].id_in_backend) for x in found2),
+                    sorted((x[0], x[1].id_in_backend) for x in found))
+
+    def test_backend_diff(self):
+        """BackendDiff finds identical, similar and exclusive gpxfiles."""
+        far = [GpxFile(), GpxFile()]
+        for _ in far:
+            _.add_points(self._random_points(root=GPXTrackPoint(latitude=-30, longitude=-60)))
+        left = [self.create_test_track(), far[0]]
+        right = [left[0].clone(), left[0].clone(), far[1]]
+        points = list(right[1].points())
+        with right[1]._decouple():
+            right[1].gpx.tracks[0].segments[0].points.remove(points[3])
+        differ = BackendDiff(left, right)
+        self.assertEqual(differ.identical, [left[0]])
+        self.assertEqual([(x.left, x.right) for x in differ.similar], [(left[0], right[1])])
+        self.assertEqual(len(differ.similar[0].differences['P']), 1)
+        self.assertIn('missing on the right', differ.similar[0].differences['P'][0])
+        self.assertEqual(differ.left.exclusive, [far[0]])
+        self.assertEqual(differ.right.exclusive, [far[1]])
+
+        # the digest rounds to 5 digits, but == does not round
+        near_zero = [GpxFile(), GpxFile()]
+        for _, delta in zip(near_zero, (1e-6, 4e-6)):
+            _.add_points([GPXTrackPoint(latitude=delta, longitude=delta + idx * 1e-3) for idx in range(5)])
+        digest = BackendDiff.BackendDiffSide.digest
+        self.assertEqual(digest(near_zero[0]), digest(near_zero[1]))
+        self.assertNotEqual(near_zero[0], near_zero[1])
+        differ = BackendDiff(near_zero[0], near_zero[1])
+        self.assertEqual(differ.identical, [])
+        self.assertEqual(differ.left.exclusive, [near_zero[0]])
+
+    def test_opcodes(self):
+        """_opcodes returns a shortest edit script, also for repeated positions."""
+        rnd = random.Random(5)
+        for _ in range(300):
+            left = [rnd.randrange(4) for _ in range(rnd.randrange(15))]
+            right = [rnd.randrange(4) for _ in range(rnd.randrange(15))]
+            lcs = [[0] * (len(right) + 1) for _ in range(len(left) + 1)]
+            for left_idx, left_item in enumerate(left):
+                for right_idx, right_item in enumerate(right):
+                    lcs[left_idx + 1][right_idx + 1] = (
+                        lcs[left_idx][right_idx] + 1 if left_item == right_item
+                        else max(lcs[left_idx][right_idx + 1], lcs[left_idx + 1][right_idx]))
+            opcodes = _opcodes(left, right)
+            self.assertEqual(sum(x[2] - x[1] for x in opcodes if x[0] == 'equal'), lcs[-1][-1])
+            rebuilt = list()
+            for tag, left_start, left_end, right_start, right_end in opcodes:
+                if tag == 'equal':
+                    self.assertEqual(left[left_start:left_end], right[right_start:right_end])
+                rebuilt.extend(right[right_start:right_end])
+            self.assertEqual(rebuilt, right)
+
     @skipIf(*disabled(Directory))
     def test_save(self):
         """save locally."""
@@ -592,6 +736,32 @@ class TrackTests(BasicTest):
         self.assertEqual(list(GpxFile.overlapping_times(group1 + group2)), list([group1, group2]))
         group2 = list([gpxfile4])
         self.assertEqual(list(GpxFile.overlapping_times(group1 + group2)), list([group1]))
+        # gpxfile5 spans all others, gpxfile4 only overlaps with gpxfile5
+        gpxfile5 = self.create_test_track(
+            start_time=gpxfile1.first_time - seconds10, end_time=gpxfile4.last_time + seconds10)
+        self.assertEqual(
+            list(GpxFile.overlapping_times(group1 + group2 + [gpxfile5])),
+            list([[gpxfile5] + group1 + group2]))
+
+    @skipIf(*disabled(Directory))
+    def test_backend_overlapping_times(self):
+        """Backend.overlapping_times must not load the gpxfiles."""
+        with self.temp_directory() as directory:
+            gpxfile1 = self.create_test_track(start_time=datetime.datetime(2019, 3, 1, tzinfo=datetime.timezone.utc))
+            directory.add(gpxfile1)
+            directory.add(self.create_test_track(start_time=gpxfile1.last_time - datetime.timedelta(seconds=10)))
+            directory.add(self.create_test_track(start_time=gpxfile1.last_time + datetime.timedelta(days=1)))
+
+            def must_not_read(gpxfile):
+                raise AssertionError('{} must come from the index'.format(gpxfile))
+
+            with Directory(DirectoryAccount(directory.url)) as dir2:
+                dir2._read = must_not_read
+                groups = list(dir2.overlapping_times())
+                self.assertEqual(len(groups), 1)
+                self.assertEqual(groups[0][0].id_in_backend, gpxfile1.id_in_backend)
+                self.assertEqual(groups[0][0].last_time, gpxfile1.last_time)
+                self.assertEqual(len(groups[0]), 2)
 
     @skipIf(*disabled(Directory))
     def test_header_changes(self):
@@ -627,8 +797,58 @@ class TrackTests(BasicTest):
         gpxfile.gpx.is_complete = False
         gpxfile.distance = 5000
         self.assertEqual(gpxfile.distance, 5000)
+        gpxfile.point_count = 7
+        self.assertEqual(gpxfile.point_count, 7)
+        gpxfile.last_time = gpx_track.last_time
+        self.assertEqual(gpxfile.last_time, gpx_track.last_time)
+        gpxfile._set_header_ends(next(gpx_track.points()), gpx_track.last_point())
+        self.assertEqual(gpxfile.angle(), gpx_track.angle())
         gpxfile.gpx = Gpx.parse(gpx_track.xml())
         self.assertEqual(gpxfile.distance, gpx_track.distance)
+        self.assertEqual(gpxfile.point_count, gpx_track.gpx.get_track_points_no())
+        with self.assertRaises(Exception):
+            gpxfile.point_count = 7
+
+    @skipIf(*disabled(WPTrackserver))
+    def test_wptrackserver_rewrite(self):
+        """WPTrackserver only writes the points which changed."""
+        with self.temp_backend(WPTrackserver) as backend:
+            gpxfile = backend.add(self.create_test_track())
+            segment = gpxfile.gpx.tracks[0].segments[0]
+            for change in (
+                    lambda: segment.points.append(
+                        GPXTrackPoint(latitude=5, longitude=6, time=gpxfile.last_time + datetime.timedelta(seconds=5))),
+                    lambda: segment.points.pop(),
+                    lambda: setattr(segment.points[5], 'latitude', segment.points[5].latitude + 0.001),
+                    lambda: segment.points.pop(2)):
+                change()
+                gpxfile.rewrite()
+                self.assertTrue(backend.clone()[gpxfile.id_in_backend].points_equal(gpxfile))
+
+    @skipIf(*disabled(WPTrackserver))
+    def test_wptrackserver_rewrite_reread(self):
+        """A title change on a gpxfile read back from WPTrackserver keeps the location rows."""
+
+        def row_ids():
+            with backend._transaction():
+                cursor = backend._WPTrackserver__exec_mysql(
+                    'select id from wp_ts_locations where trip_id=%s order by id', [int(ident)])
+                result = [x[0] for x in cursor.fetchall()]
+                backend._rollback()
+            return result
+
+        with self.temp_backend(WPTrackserver) as backend:
+            gpxfile = self.create_test_track()
+            for idx, point in enumerate(gpxfile.point_list()):
+                point.elevation = 100.0 + idx
+            add_speed(gpxfile.point_list(), window=10)
+            ident = backend.add(gpxfile).id_in_backend
+            before = row_ids()
+            reread = backend.clone()[ident]
+            reread.title = 'changed title'
+            reread.rewrite()
+            self.assertEqual(row_ids(), before)
+            self.assertEqual(backend.clone()[ident].title, 'changed title')
 
     @skipIf(*disabled(WPTrackserver))
     def test_merge_track(self):
@@ -780,6 +1000,9 @@ class TrackTests(BasicTest):
                     self.assertFalse(fences.outside(point))
                 for point in outside:
                     self.assertTrue(fences.outside(point))
+                point_list = list(points)
+                self.assertEqual(
+                    {x for x, mask in zip(point_list, fences.mask(point_list)) if mask}, outside)
 
     def test_openrunner_point_encoding(self):
         """Test Openrunner encoding/decoding of points."""
@@ -22,15 +22,20 @@ last part of the strings will be thrown away silently when writing into the data
 # pylint: disable=protected-access
 
 import datetime
+import functools
+import logging
+import threading
+from contextlib import contextmanager
 
 from gpxpy import gpx as mod_gpx
 
 from ..backend import Backend
 from ..gpx import Gpx
-from ..util import add_speed, utc_datetime, local_datetime
+from ..util import add_speed, utc_datetime, local_datetime, utc_to_local_delta
 
 try:
     import MySQLdb
+    import MySQLdb.cursors
     HAVE_MYSQL = True
 except ImportError:
     HAVE_MYSQL = False
@@ -38,6 +43,159 @@ except ImportError:
 __all__ = ['WPTrackserver']
 
 
+class ConnectionPool:
+
+    """A bounded pool of database connections.
+
+    There is one pool per key, see :meth:`get`. A connection is given to
+    one user at a time. If all connections are in use, :meth:`acquire` waits
+    up to :attr:`timeout` seconds.
+    Idle connections are checked with ping() before they are given out again,
+    dead ones are replaced.
+
+    Args:
+        connect: A function returning a new connection
+        max_connections: The upper limit for open connections. Default is :attr:`max_connections`
+
+    Attributes:
+        max_connections: See Args
+        created: The number of connections opened so far
+        timeout: Seconds :meth:`acquire` waits for a free connection
+
+    """
+
+    max_connections = 4
+    timeout = 60
+
+    __pools = dict()
+    __pools_lock = threading.Lock()
+
+    def __init__(self, connect, max_connections: int = None):
+        """See class docstring."""
+        self.__connect = connect
+        self.max_connections = max_connections or ConnectionPool.max_connections
+        self.created = 0
+        self.__idle = list()
+        self.__open = 0
+        self.__users = 0
+        self.__condition = threading.Condition()
+
+    @classmethod
+    def get(cls, key, connect):
+        """The pool for key. It is created if needed.
+
+        Every call must be paired with a call to :meth:`remove`.
+
+        Args:
+            key: Connections for the same key are shared
+            connect: See class docstring. Only used when the pool is created.
+                This is kept as long as the pool lives, so it should not reference a backend.
+
+        Returns: ConnectionPool
+
+        """
+        with cls.__pools_lock:
+            if key not in cls.__pools:
+                cls.__pools[key] = cls(connect)
+            result = cls.__pools[key]
+            result.__users += 1
+            return result
+
+    @classmethod
+    def remove(cls, key):
+        """The caller of :meth:`get` does not need the pool anymore.
+
+        After the last caller is gone, close all idle connections for key and forget the pool.
+
+        """
+        with cls.__pools_lock:
+            pool = cls.__pools.get(key)
+            if pool is None:
+                return
+            pool.__users -= 1
+            if pool.__users > 0:
+                return
+            del cls.__pools[key]
+        pool.close()
+
+    @staticmethod
+    def __healthy(connection) ->bool:
+        """Check if the connection still works.
+
+        Returns: True or False
+
+        """
+        try:
+            connection.ping()
+            return True
+        except Exception:  # pylint: disable=broad-except
+            return False
+
+    @staticmethod
+    def __close(connection):
+        """Close, ignoring errors."""
+        try:
+            connection.close()
+        except Exception:  # pylint: disable=broad-except
+            pass
+
+    def acquire(self):
+        """Get a connection. Give it back with :meth:`release` or :meth:`discard`.
+
+        Raises BackendException if no connection is free within :attr:`timeout` seconds.
+
+        Returns: The connection
+
+        """
+        with self.__condition:
+            if not self.__condition.wait_for(
+                    lambda: self.__idle or self.__open < self.max_connections, self.timeout):
+                raise Backend.BackendException(
+                    'ConnectionPool: all {} connections are still in use after {} seconds'.format(
+                        self.max_connections, self.timeout))
+            if self.__idle:
+                result = self.__idle.pop()
+            else:
+                result = None
+                self.__open += 1
+        if result is not None and not self.__healthy(result):
+            self.__close(result)
+            result = None
+        if result is None:
+            try:
+                result = self.__connect()
+            except BaseException:
+                with self.__condition:
+                    self.__open -= 1
+                    self.__condition.notify()
+                raise
+            self.created += 1
+        return result
+
+    def release(self, connection):
+        """Give a connection back for reuse."""
+        with self.__condition:
+            self.__idle.append(connection)
+            self.__condition.notify()
+
+    def discard(self, connection):
+        """Give a broken connection back. It is closed."""
+        self.__close(connection)
+        with self.__condition:
+            self.__open -= 1
+            self.__condition.notify()
+
+    def close(self):
+        """Close all idle connections."""
+        with self.__condition:
+            idle = self.__idle
+            self.__idle = list()
+            self.__open -= len(idle)
+            self.__condition.notify_all()
+        for _ in idle:
+            self.__close(_)
+
+
 class WPTrackserver(Backend):
 
     """Talk directly to the wordpress mysql database holding the trackserver data.
@@ -65,50 +223,131 @@ class WPTrackserver(Backend):
 
     test_is_expensive = False
 
+    # every thread gets its own connection from the pool
+    max_prefetch_workers = ConnectionPool.max_connections
+
     _keywords_marker = '\nKEYWORDS: '
 
     _max_length = {'title': 255, 'description': 255}
 
+    # _write_all updates single rows if at most this part of them changed
+    _max_patched_ratio = 0.1
+
+    # _read fetches that many rows at once
+    _read_chunk_size = 5000
+
     def __init__(self, account=None):
         """See class docstring. The url is host."""
         super(WPTrackserver, self).__init__(account)
-        self.__cached_db = None
+        self.__local = threading.local()
         self.__cached_user_id = None
+        self.__pool = None
 
-    def __connect_mysql(self):
+    @staticmethod
+    def __connect_mysql(host, mysql, password):
         """Connect to the Mysql server.
 
+        This gets no backend, see :meth:`ConnectionPool.get`.
+
+        Args:
+            host: The url of the account
+            mysql: user@database
+            password: The password for the mysql user
+
         Returns: The db handle
 
         """
         try:
-            user, database = self.account.mysql.split('@')
+            user, database = mysql.split('@')
         except ValueError:
-            raise Backend.BackendException('Url is illegal: {}'.format(self.url))
+            raise Backend.BackendException('Url is illegal: {}'.format(host))
         try:
             result = MySQLdb.connect(
-                host=self.url, user=user, passwd=self.account.password, database=database,
+                host=host, user=user, passwd=password, database=database,
                 autocommit=False, charset='utf8')
-            if self.__cached_db:
-                self.logger.info('reconnected to %s %s', self.url, database)
-            else:
-                self.logger.info('connected to %s %s', self.url, database)
+            logging.info('connected to %s %s', host, database)
             return result
         except MySQLdb._exceptions.Error as exc:
             raise Backend.BackendException(
                 '{}: host={} user={} passwd={} database={}'.format(
-                    exc, self.url, user, self.account.password, database))
+                    exc, host, user, password, database))
+
+    def __pool_key(self):
+        """All WPTrackserver instances with the same key share a :class:`ConnectionPool`.
+
+        Returns: The key
+
+        """
+        return (self.url, self.account.mysql, self.account.password)
+
+    @property
+    def _pool(self):
+        """The connection pool for our account. :meth:`detach` gives it up.
+
+        Returns: ConnectionPool
+
+        """
+        if self.__pool is None:
+            self.__pool = ConnectionPool.get(self.__pool_key(), functools.partial(
+                WPTrackserver.__connect_mysql, self.url, self.account.mysql, self.account.password))
+        return self.__pool
 
     @property
     def _db(self):
-        """Cached mysql handle.
+        """The mysql handle for the current transaction in this thread.
+
+        It is taken from the pool and given back by :meth:`_commit` and :meth:`_rollback`.
 
         Returns: The handle.
 
         """
-        if self.__cached_db is None:
-            self.__cached_db = self.__connect_mysql()
-        return self.__cached_db
+        result = getattr(self.__local, 'db', None)
+        if result is None:
+            result = self._pool.acquire()
+            self.__local.db = result
+            self.__local.fresh = True
+        return result
+
+    def __release(self, broken: bool = False):
+        """Give the handle of this thread back to the pool."""
+        handle = getattr(self.__local, 'db', None)
+        if handle is not None:
+            self.__local.db = None
+            if broken:
+                self._pool.discard(handle)
+            else:
+                self._pool.release(handle)
+
+    @contextmanager
+    def _transaction(self):
+        """Make sure the handle goes back to the pool if something fails.
+
+        The caller ends the transaction with :meth:`_commit` or :meth:`_rollback`. If
+        an exception leaves the block, the transaction is rolled back and the handle
+        is discarded.
+
+        """
+        try:
+            yield
+        except BaseException:
+            handle = getattr(self.__local, 'db', None)
+            if handle is not None:
+                try:
+                    handle.rollback()
+                except Exception:  # pylint: disable=broad-except
+                    pass
+                self.__release(broken=True)
+            raise
+
+    def _commit(self):
+        """Commit the transaction and give the handle back."""
+        self._db.commit()
+        self.__release()
+
+    def _rollback(self):
+        """Roll back the transaction and give the handle back."""
+        self._db.rollback()
+        self.__release()
 
     @property
     def _user_id(self):
@@ -120,12 +359,13 @@ class WPTrackserver(Backend):
         if self.__cached_user_id is None:
             if not self.account.username:
                 raise self.BackendException('{} needs a username'.format(self.account))
-            cursor = self.__exec_mysql('select id from wp_users where user_login=%s', [self.account.username])
-            row = cursor.fetchone()
-            if row is None:
-                raise Backend.BackendException('WPTrackserver: User {} is not known'.format(self.account.username))
-            self.__cached_user_id = row[0]
-            self._db.rollback()
+            with self._transaction():
+                cursor = self.__exec_mysql('select id from wp_users where user_login=%s', [self.account.username])
+                row = cursor.fetchone()
+                if row is None:
+                    raise Backend.BackendException('WPTrackserver: User {} is not known'.format(self.account.username))
+                self.__cached_user_id = row[0]
+                self._rollback()
         return self.__cached_user_id
 
     def _encode_description(self, gpxfile):
@@ -181,40 +421,91 @@ class WPTrackserver(Backend):
         return result
 
     def _list(self):
-        """."""
-        cmd = 'select id,created,name,comment,distance from wp_ts_tracks where user_id=%s'
-        args = (self._user_id, )  # noqa
-        cursor = self.__exec_mysql(cmd, args)
-        for _ in cursor.fetchall():
-            gpxfile = self._found_gpxfile(str(int(_[0])), self._gpx_from_headers(_))
-            gpxfile.gpx.is_complete = False
-            gpxfile.distance = _[4] / 1000.0
-        self._db.rollback()
+        """Get all gpxfiles with their headers.
+
+        The first and last time, the point count and the first and last position
+        come from aggregates over wp_ts_locations, so no points need to be read.
+
+        """
+        cmd = 'select t.id,t.created,t.name,t.comment,t.distance,' \
+            's.first_occurred,s.last_occurred,s.points,f.latitude,f.longitude,l.latitude,l.longitude' \
+            ' from wp_ts_tracks t left join (' \
+            'select trip_id,min(occurred) first_occurred,max(occurred) last_occurred,count(*) points,' \
+            'min(id) first_id,max(id) last_id from wp_ts_locations' \
+            ' where trip_id in (select id from wp_ts_tracks where user_id=%s) group by trip_id' \
+            ') s on s.trip_id=t.id' \
+            ' left join wp_ts_locations f on f.id=s.first_id' \
+            ' left join wp_ts_locations l on l.id=s.last_id' \
+            ' where t.user_id=%s'
+        args = (self._user_id, self._user_id)  # noqa
+        with self._transaction():
+            cursor = self.__exec_mysql(cmd, args)
+            for _ in cursor.fetchall():
+                gpx = self._gpx_from_headers(_)
+                if _[5] is not None:
+                    gpx.time = utc_datetime(_[5])
+                gpxfile = self._found_gpxfile(str(int(_[0])), gpx)
+                gpxfile.gpx.is_complete = False
+                gpxfile.distance = _[4] / 1000.0
+                gpxfile.point_count = _[7] or 0
+                if _[6] is not None:
+                    gpxfile.last_time = utc_datetime(_[6])
+                if _[8] is not None:
+                    gpxfile._set_header_ends(*(
+                        mod_gpx.GPXTrackPoint(latitude=round(float(lat), 6), longitude=round(float(lon), 6))
+                        for lat, lon in (_[8:10], _[10:12])))
+            self._rollback()
 
     @staticmethod
-    def __point(row):
+    def __point(row, local_delta):
         """Make a GPX point.
 
+        Args:
+            row: latitude, longitude, occurred, comment, altitude, speed
+            local_delta: The result of :func:`~gpxity.util.utc_to_local_delta`
+
         Returns:
             The point
 
         """
-        return mod_gpx.GPXTrackPoint(
+        occurred = row[2]
+        if occurred is not None:
+            occurred -= local_delta
+            if not occurred.tzinfo:
+                occurred = occurred.replace(tzinfo=datetime.timezone.utc)
+        result = mod_gpx.GPXTrackPoint(
             latitude=float(row[0]),
             longitude=float(row[1]),
-            time=utc_datetime(row[2]),
+            elevation=float(row[4]) if row[4] else None,
+            time=occurred,
             name=row[3])
+        result.gpxity_speed = float(row[5] or 0.0)
+        return result
 
     def _read(self, gpxfile) ->None:
-        """Read the full gpxfile."""
+        """Read the full gpxfile.
+
+        The rows are streamed from the server and added in chunks of :attr:`_read_chunk_size`.
+
+        """
         assert gpxfile.id_in_backend
         assert not gpxfile.gpx.is_complete
-        cursor = self.__exec_mysql(
-            'select latitude,longitude,occurred,comment from wp_ts_locations where trip_id=%s',
-            [gpxfile.id_in_backend])
-        gpxfile.add_points([self.__point(x) for x in cursor.fetchall()])
-        gpxfile.gpx.is_complete = True
-        self._db.rollback()
+        local_delta = utc_to_local_delta()
+        with self._transaction():
+            cursor = self.__exec_mysql(
+                'select latitude,longitude,occurred,comment,altitude,speed'
+                ' from wp_ts_locations where trip_id=%s order by id',
+                [gpxfile.id_in_backend], cursorclass=MySQLdb.cursors.SSCursor)
+            try:
+                while True:
+                    rows = cursor.fetchmany(self._read_chunk_size)
+                    if not rows:
+                        break
+                    gpxfile.add_points([self.__point(x, local_delta) for x in rows])
+            finally:
+                cursor.close()
+            gpxfile.gpx.is_complete = True
+            self._rollback()
 
     @staticmethod
     def __needs_insert(cursor, ident) -> bool:
@@ -273,32 +564,102 @@ class WPTrackserver(Backend):
             the new gpxfile.id_in_backend
 
         """
-        result = self._save_header(gpxfile)
-        self.__exec_mysql('delete from wp_ts_locations where trip_id=%s', [int(result)])
-        self.__write_points(gpxfile, gpxfile.points())
-        self._db.commit()
+        with self._transaction():
+            result = self._save_header(gpxfile)
+            self.__write_changed_points(gpxfile, list(gpxfile.points()))
+            self._commit()
         return result
 
-    def __write_points(self, gpxfile, points):
-        """save points in the gpxfile."""
-        points = list(points)
+    @staticmethod
+    def __location(gpxfile, point):
+        """The values for a row in wp_ts_locations.
+
+        Returns: A tuple with trip_id, latitude, longitude, altitude, occurred, speed, comment, heading
+
+        """
+        return (
+            gpxfile.id_in_backend, point.latitude, point.longitude, point.elevation or 0.0,
+            local_datetime(point.time), point.gpxity_speed if hasattr(point, 'gpxity_speed') else 0.0,
+            point.name or '', 0.0)
+
+    @staticmethod
+    def __comparable(location):
+        """Make a location as written by us comparable with a row read from wp_ts_locations.
+
+        heading is ignored: we always write 0.0 but other clients may store a real value.
+        All other columns are loaded by :meth:`_read`, so a gpxfile read back from the
+        server compares equal with its rows.
+
+        Args:
+            location: latitude, longitude, altitude, occurred, speed, comment, heading
+
+        Returns: A tuple
+
+        """
+        latitude, longitude, altitude, occurred, speed, comment, _ = location
+        return (
+            float(latitude), float(longitude), float(altitude or 0.0),
+            occurred.replace(microsecond=0, tzinfo=None) if occurred else None,
+            float(speed or 0.0), comment or '')
+
+    def __write_changed_points(self, gpxfile, points):
+        """Make the stored points equal to points, touching as few rows as possible.
+
+        Rows which are already stored are kept. If only a few rows differ, they
+        are updated. Otherwise all rows after the common head are replaced. If there
+        is no common head, all rows are rewritten.
+
+        """
+        ident = int(gpxfile.id_in_backend)
+        cursor = self.__exec_mysql(
+            'select id,latitude,longitude,altitude,occurred,speed,comment,heading'
+            ' from wp_ts_locations where trip_id=%s order by id', [ident])
+        stored = cursor.fetchall()
+        row_ids = [x[0] for x in stored]
+        stored = [self.__comparable(x[1:]) for x in stored]
+        locations = [self.__location(gpxfile, x) for x in points]
+        wanted = [self.__comparable(x[1:]) for x in locations]
+        if len(stored) == len(wanted):
+            changed = [idx for idx, (old, new) in enumerate(zip(stored, wanted)) if old != new]
+            if len(changed) <= len(wanted) * self._max_patched_ratio:
+                if changed:
+                    self.__exec_mysql(
+                        'update wp_ts_locations set trip_id=%s,latitude=%s,longitude=%s,altitude=%s,'
+                        'occurred=%s,speed=%s,comment=%s,heading=%s where id=%s',
+                        [locations[x] + (row_ids[x], ) for x in changed], many=True)
+                return
+        head = 0
+        for old, new in zip(stored, wanted):
+            if old != new:
+                break
+            head += 1
+        if head == 0:
+            self.__exec_mysql('delete from wp_ts_locations where trip_id=%s', [ident])
+        elif head < len(stored):
+            self.__exec_mysql(
+                'delete from wp_ts_locations where trip_id=%s and id>=%s', [ident, row_ids[head]])
+        self.__insert_locations(locations[head:])
+
+    def __insert_locations(self, locations):
+        """Insert rows into wp_ts_locations."""
         cmd = 'insert into wp_ts_locations(trip_id, latitude, longitude, altitude,' \
             ' occurred, speed, comment, heading)' \
             ' values(%s, %s, %s, %s, %s, %s, %s, %s)'
-        args = [(
-            gpxfile.id_in_backend, x.latitude, x.longitude, x.elevation or 0.0,
-            local_datetime(x.time), x.gpxity_speed if hasattr(x, 'gpxity_speed') else 0.0,
-            x.name or '', 0.0) for x in points]
-        if args:
-            self.__exec_mysql(cmd, args, many=True)
+        if locations:
+            self.__exec_mysql(cmd, locations, many=True)
+
+    def __write_points(self, gpxfile, points):
+        """save points in the gpxfile."""
+        self.__insert_locations([self.__location(gpxfile, x) for x in points])
 
     def _remove_ident(self, ident: str) ->None:
         """backend dependent implementation."""
-        cmd = 'delete from wp_ts_locations where trip_id=%s'
-        self.__exec_mysql(cmd, [int(ident)])
-        cmd = 'delete from wp_ts_tracks where id=%s'
-        self.__exec_mysql(cmd, [int(ident)])
-        self._db.commit()
+        with self._transaction():
+            cmd = 'delete from wp_ts_locations where trip_id=%s'
+            self.__exec_mysql(cmd, [int(ident)])
+            cmd = 'delete from wp_ts_tracks where id=%s'
+            self.__exec_mysql(cmd, [int(ident)])
+            self._commit()
 
     def _change_ident(self, gpxfile, new_ident: str):
         """Change the id in the backend."""
@@ -307,21 +668,18 @@ class WPTrackserver(Backend):
             raise ValueError(
                 'New id_in_backend {} already exists in {}'.format(
                     new_ident, self.account))
-        try:
-            self.__exec_mysql(
-                'update wp_ts_tracks set id=%s where id=%s',
-                (new_ident, gpxfile.id_in_backend))
-        except MySQLdb._exceptions.DataError as exc:
-            self._db.rollback()
-            raise ValueError(str(exc))
-        try:
+        with self._transaction():
+            try:
+                self.__exec_mysql(
+                    'update wp_ts_tracks set id=%s where id=%s',
+                    (new_ident, gpxfile.id_in_backend))
+            except MySQLdb._exceptions.DataError as exc:
+                self._rollback()
+                raise ValueError(str(exc))
             self.__exec_mysql(
                 'update wp_ts_locations set trip_id=%s where trip_id=%s',
                 (new_ident, gpxfile.id_in_backend))
-            self._db.commit()
-        except BaseException:
-            self._db.rollback()
-            raise
+            self._commit()
 
         self.logger.info('%s: renamed %s to %s', self.account, gpxfile.id_in_backend, new_ident)
         gpxfile.id_in_backend = new_ident
@@ -352,8 +710,9 @@ class WPTrackserver(Backend):
         assert points
         assert gpxfile.gpx.is_complete
         gpxfile.gpx.encode()
-        new_ident = self._save_header(gpxfile)
-        self._lifetrack_update(gpxfile, points)
+        with self._transaction():
+            new_ident = self._save_header(gpxfile)
+            self._lifetrack_update(gpxfile, points)
         return new_ident
 
     def _lifetrack_update(self, gpxfile, points):
@@ -365,16 +724,20 @@ class WPTrackserver(Backend):
 
         """
         points = list(points)
-        add_speed(list(gpxfile.points()), window=10)
-        cmd = 'update wp_ts_tracks set distance=%s where id=%s'
-        args = (gpxfile.distance * 1000, gpxfile.id_in_backend)
-        self.__exec_mysql(cmd, args)
-        self.__write_points(gpxfile, points)
-        self._db.commit()
-
-    def __exec_mysql(self, cmd, args, many=False):
+        add_speed(gpxfile._point_list(), window=10)
+        with self._transaction():
+            cmd = 'update wp_ts_tracks set distance=%s where id=%s'
+            args = (gpxfile.distance * 1000, gpxfile.id_in_backend)
+            self.__exec_mysql(cmd, args)
+            self.__write_points(gpxfile, points)
+            self._commit()
+
+    def __exec_mysql(self, cmd, args, many=False, cursorclass=None):
         """Wrapper.
 
+        Args:
+            cursorclass: Passed to MySQLdb. If None, use the default.
+
         Returns:
             cursor or None if done nothing
 
@@ -392,16 +755,34 @@ class WPTrackserver(Backend):
             except MySQLdb._exceptions.Error as exception:
                 logit("MySQL Error: {} for".format(exception))
                 raise
-        cursor = self._db.cursor()
+        handle = self._db
+        fresh = self.__local.fresh
+        cursor = handle.cursor(cursorclass)
+        self.__local.fresh = False
         execute = cursor.executemany if many else cursor.execute
         try:
             do_it()
         except MySQLdb._exceptions.OperationalError:
-            # timeout disconnected
-            self.__connect_mysql()
+            # The connection is gone. Only retry if nothing else happened
+            # in this transaction.
+            self.__release(broken=True)
+            if not fresh:
+                raise
+            cursor = self._db.cursor(cursorclass)
+            self.__local.fresh = False
+            execute = cursor.executemany if many else cursor.execute
             do_it()
         return cursor
 
+    def detach(self):
+        """Give the connection and the pool back."""
+        super(WPTrackserver, self).detach()
+        if getattr(self.__local, 'db', None) is not None:
+            self._rollback()
+        if self.__pool is not None:
+            self.__pool = None
+            ConnectionPool.remove(self.__pool_key())
+
     @classmethod
     def _check_id_legal(cls, value):
         """Check if value is a legal id.
@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2019 Wolfgang Rohdewald <wolfgang@rohdewald.de>
+# See LICENSE for details.
+
+"""This module defines :class:`~gpxity.columns.PointColumns` and :class:`~gpxity.columns.BoundsIndex`."""
+
+import datetime
+import hashlib
+from operator import attrgetter
+
+import numpy
+
+from gpxpy.geo import EARTH_RADIUS, ONE_DEGREE
+
+__all__ = ['PointColumns', 'BoundsIndex']
+
+
+def _isclose(left, right, tolerance):
+    """Elementwise math.isclose(left, right, rel_tol=tolerance).
+
+    Returns: numpy array of bool
+
+    """
+    return numpy.abs(left - right) <= tolerance * numpy.maximum(numpy.abs(left), numpy.abs(right))
+
+
+def _anchors(size):
+    """Indices 0 and size - 1, followed by bisecting until all indices are yielded.
+
+    Yields: int
+
+    """
+    yield 0
+    if size > 1:
+        yield size - 1
+    intervals = [(0, size - 1)]
+    while intervals:
+        next_intervals = list()
+        for low, high in intervals:
+            if high - low > 1:
+                middle = (low + high) // 2
+                yield middle
+                next_intervals.extend(((low, middle), (middle, high)))
+        intervals = next_intervals
+
+
+class PointColumns:
+
+    """Contiguous float64 arrays for a sequence of points.
+
+    The gpxpy points stay the authoritative data, PointColumns is derived
+    from them and must be rebuilt if they change. Missing values are
+    stored as nan.
+
+    Args:
+        latitude: numpy array
+        longitude: numpy array
+        elevation: numpy array
+        time: A function returning a numpy array with seconds since the epoch (UTC).
+            Converting datetime is expensive, so this is only done when needed.
+
+    Attributes:
+        latitude, longitude, elevation: See Args
+        time: See Args, the result of calling time
+        size: The number of points
+
+    """
+
+    # pylint: disable=too-few-public-methods
+
+    # index() compares full sequences for that many start positions
+    _few_candidates = 8
+
+    def __init__(self, latitude, longitude, elevation, time):
+        """See class docstring."""
+        self.latitude = latitude
+        self.longitude = longitude
+        self.elevation = elevation
+        self.__make_time = time
+        self.__time = None
+        self.size = len(latitude)
+
+    @property
+    def time(self):
+        """See class docstring.
+
+        Returns: numpy array
+
+        """
+        if self.__time is None:
+            self.__time = self.__make_time()
+        return self.__time
+
+    @staticmethod
+    def _timestamp(value) ->float:
+        """Seconds since the epoch. Times without tzinfo are UTC.
+
+        Returns: float or nan
+
+        """
+        if value is None:
+            return numpy.nan
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=datetime.timezone.utc)
+        return value.timestamp()
+
+    @classmethod
+    def from_points(cls, points):
+        """Build from a list of GPXTrackPoint.
+
+        Returns: PointColumns
+
+        """
+        def column(name):
+            """None becomes nan.
+
+            Returns: numpy array
+
+            """
+            return numpy.array(list(map(attrgetter(name), points)), dtype=float)
+
+        return cls(
+            column('latitude'), column('longitude'), column('elevation'),
+            lambda: numpy.fromiter((cls._timestamp(x.time) for x in points), float, len(points)))
+
+    @classmethod
+    def concatenate(cls, parts):
+        """Combine several PointColumns into one.
+
+        Returns: PointColumns
+
+        """
+        if len(parts) == 1:
+            return parts[0]
+        if not parts:
+            empty = numpy.empty(0)
+            return cls(empty, empty, empty, lambda: empty)
+        return cls(
+            *(numpy.concatenate([getattr(x, name) for x in parts]) for name in ('latitude', 'longitude', 'elevation')),
+            lambda: numpy.concatenate([x.time for x in parts]))
+
+    def distances(self, forward: bool = False):
+        """The distances in meters between adjacent points, like gpxpy distance_2d does it.
+
+        Near points use the flat earth formula, points more than 0.2 degrees apart
+        use haversine. The result has size - 1 elements.
+
+        The flat earth formula uses the latitude of one of the points, so the result
+        depends on the direction by some rounding errors.
+
+        Args:
+            forward: If False, like later.distance_2d(earlier) as in gpxpy.geo.length.
+                If True, like earlier.distance_2d(later).
+
+        Returns: numpy array
+
+        """
+        lat1 = self.latitude[1:]
+        lon1 = self.longitude[1:]
+        lat2 = self.latitude[:-1]
+        lon2 = self.longitude[:-1]
+        if forward:
+            lat1, lon1, lat2, lon2 = lat2, lon2, lat1, lon1
+        delta_lat = lat1 - lat2
+        delta_lon = lon1 - lon2
+        with numpy.errstate(invalid='ignore'):
+            flat = numpy.sqrt(delta_lat ** 2 + (delta_lon * numpy.cos(numpy.radians(lat1))) ** 2) * ONE_DEGREE
+            far = (numpy.abs(delta_lat) > 0.2) | (numpy.abs(delta_lon) > 0.2)
+            if far.any():
+                rad1 = numpy.radians(lat1[far])
+                rad2 = numpy.radians(lat2[far])
+                _ = (numpy.sin((rad1 - rad2) / 2) ** 2
+                     + numpy.sin(numpy.radians(delta_lon[far]) / 2) ** 2 * numpy.cos(rad1) * numpy.cos(rad2))
+                flat[far] = EARTH_RADIUS * 2 * numpy.arcsin(numpy.sqrt(_))
+        return flat
+
+    def angles(self, precision=6):
+        """The angles between adjacent points, like :meth:`Gpx.angle <gpxity.gpx.Gpx.angle>` does it.
+
+        The result has size - 1 elements.
+
+        Args:
+            precision: After comma digits
+
+        Returns: numpy array with degrees 0..360
+
+        """
+        latitude = numpy.round(self.latitude, precision)
+        longitude = numpy.round(self.longitude, precision)
+        norm_lat = (latitude[:-1] - latitude[1:]) / 90.0
+        norm_long = (longitude[:-1] - longitude[1:]) / 180.0
+        norm = numpy.sqrt(norm_lat ** 2 + norm_long ** 2)
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            result = numpy.degrees(numpy.arcsin(numpy.clip(norm_long / norm, -1.0, 1.0)))
+        result = numpy.where(norm_lat >= 0.0, (360.0 + result) % 360.0, 180.0 - result)
+        return numpy.where(norm == 0.0, 0.0, result)
+
+    def length(self) ->float:
+        """The 2d length in meters, like gpxpy.geo.length.
+
+        Returns: float
+
+        """
+        if self.size < 2:
+            return 0.0
+        return float(numpy.nansum(self.distances()))
+
+    def positions_close(self, other, digits=4, start=0):
+        """Compare positions like :func:`~gpxity.util.positions_equal`.
+
+        Args:
+            other: PointColumns, compared against self starting at index start
+            digits: Number of after comma digits to compare
+            start: Index into self
+
+        Returns: A numpy array of bool with other.size elements
+
+        """
+        tolerance = 1 / 10 ** digits
+        end = start + other.size
+        return (_isclose(self.longitude[start:end], other.longitude, tolerance)
+                & _isclose(self.latitude[start:end], other.latitude, tolerance))
+
+    def positions_equal(self, other, digits=4) ->bool:
+        """Check if both have the same size and all positions are close.
+
+        Returns: True or False
+
+        """
+        if self.size != other.size:
+            return False
+        return bool(self.positions_close(other, digits).all())
+
+    def index(self, other, digits=4):
+        """Find other in self.
+
+        Args:
+            other: PointColumns
+            digits: Number of after comma digits to compare
+
+        Returns:
+            None or the first index in self where all positions of other are close
+
+        """
+        if other.size > self.size:
+            return None
+        if not other.size:
+            return 0
+        tolerance = 1 / 10 ** digits
+
+        def matching(candidates, other_idx):
+            """Filter candidates by a single point of other.
+
+            Returns: The remaining candidates
+
+            """
+            idx = candidates + other_idx
+            return candidates[
+                _isclose(self.longitude[idx], other.longitude[other_idx], tolerance)
+                & _isclose(self.latitude[idx], other.latitude[other_idx], tolerance)]
+
+        candidates = numpy.arange(self.size - other.size + 1)
+        # Narrow down the possible start positions by looking at single points of
+        # other: first the ends, then bisecting. Normally very few candidates remain
+        # after the first two points. Each step only looks at the remaining candidates.
+        for other_idx in _anchors(other.size):
+            if len(candidates) <= self._few_candidates:
+                break
+            remaining = matching(candidates, other_idx)
+            if len(remaining) == len(candidates):
+                # Probably standing still. Compare the first candidate completely,
+                # if it fails, the first differing point is a good filter.
+                equal = self.positions_close(other, digits, int(remaining[0]))
+                if equal.all():
+                    return int(remaining[0])
+                remaining = matching(remaining[1:], int(equal.argmin()))
+            candidates = remaining
+        for start in candidates:
+            if self.positions_close(other, digits, int(start)).all():
+                return int(start)
+        return None
+
+    def digest(self) ->str:
+        """A digest over all values.
+
+        Returns: The hex digest
+
+        """
+        result = hashlib.sha1()
+        for _ in (self.longitude, self.latitude, self.elevation, self.time):
+            result.update(numpy.ascontiguousarray(_).tobytes())
+        return result.hexdigest()
+
+
+class BoundsIndex:
+
+    """Bounding boxes for many point sequences, used for pruning before expensive comparisons.
+
+    All tests are necessary conditions for the corresponding tests in
+    :class:`PointColumns` with the same digits. They never reject a pair
+    which PointColumns would accept.
+
+    Args:
+        columns: A list of PointColumns
+        digits: Number of after comma digits to compare
+
+    """
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, columns, digits=4):
+        """See class docstring."""
+        self.size = numpy.array([x.size for x in columns], dtype=int)
+        nan = numpy.nan
+        self.bounds = numpy.array([
+            (x.latitude.min(), x.latitude.max(), x.longitude.min(), x.longitude.max())
+            if x.size else (nan, nan, nan, nan) for x in columns], dtype=float).reshape(-1, 4)
+        self.tolerance = 1 / 10 ** digits
+        with numpy.errstate(invalid='ignore'):
+            self.__magnitude = numpy.nanmax(numpy.abs(self.bounds), axis=1, initial=0.0)
+
+    def __margin(self, idx):
+        """The maximal difference _isclose accepts between idx and all others.
+
+        Returns: numpy array
+
+        """
+        # a little more because of rounding errors
+        return self.tolerance * numpy.maximum(self.__magnitude, self.__magnitude[idx]) * (1 + 1e-9) + 1e-12
+
+    def within(self, idx):
+        """Which sequences might be found in sequence idx by :meth:`PointColumns.index`.
+
+        Returns: numpy array of bool
+
+        """
+        margin = self.__margin(idx)
+        lat_min, lat_max, lon_min, lon_max = self.bounds[idx]
+        bounds = self.bounds
+        with numpy.errstate(invalid='ignore'):
+            result = ((bounds[:, 0] >= lat_min - margin) & (bounds[:, 1] <= lat_max + margin)
+                      & (bounds[:, 2] >= lon_min - margin) & (bounds[:, 3] <= lon_max + margin))
+        return (result & (self.size <= self.size[idx])) | (self.size == 0)
+
+    def containing(self, idx):
+        """Which sequences might contain sequence idx, see :meth:`within`.
+
+        Returns: numpy array of bool
+
+        """
+        if not self.size[idx]:
+            return numpy.ones(len(self.size), dtype=bool)
+        margin = self.__margin(idx)
+        lat_min, lat_max, lon_min, lon_max = self.bounds[idx]
+        bounds = self.bounds
+        with numpy.errstate(invalid='ignore'):
+            result = ((lat_min >= bounds[:, 0] - margin) & (lat_max <= bounds[:, 1] + margin)
+                      & (lon_min >= bounds[:, 2] - margin) & (lon_max <= bounds[:, 3] + margin))
+        return result & (self.size >= self.size[idx])
+
+    def equal(self, idx):
+        """Which sequences might be equal to sequence idx, see :meth:`PointColumns.positions_equal`.
+
+        Returns: numpy array of bool
+
+        """
+        same_size = self.size == self.size[idx]
+        if not self.size[idx]:
+            return same_size
+        with numpy.errstate(invalid='ignore'):
+            close = numpy.abs(self.bounds - self.bounds[idx]) <= self.__margin(idx)[:, None]
+        return same_size & close.all(axis=1)
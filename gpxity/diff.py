@@ -9,16 +9,137 @@
 # pylint: disable=protected-access
 
 import datetime
+import hashlib
 
-from collections import defaultdict
+from collections import defaultdict, Counter
 from difflib import SequenceMatcher
 
+import numpy
+
 from .backend import Backend
 from .gpxfile import GpxFile
+from .columns import BoundsIndex
 
 __all__ = ['BackendDiff']
 
 
+def _myers_blocks(left, right, max_edits):
+    """The matching blocks of a shortest edit script, found with the Myers algorithm.
+
+    Args:
+        left, right: Sequences of hashable items
+        max_edits: Give up if more edits are needed
+
+    Returns:
+        A list of (left_start, right_start, size) like SequenceMatcher.get_matching_blocks()
+        but without the final dummy, or None if more than max_edits edits are needed
+
+    """
+    # pylint: disable=too-many-locals
+    left_size = len(left)
+    right_size = len(right)
+    offset = max_edits + 1
+    furthest = [0] * (2 * offset + 1)
+    trace = list()
+    for edits in range(min(left_size + right_size, max_edits) + 1):
+        # furthest x on every diagonal after edits - 1 edits
+        trace.append(furthest[offset - edits - 1:offset + edits + 2])
+        for diagonal in range(-edits, edits + 1, 2):
+            if diagonal == -edits or (
+                    diagonal != edits and furthest[offset + diagonal - 1] < furthest[offset + diagonal + 1]):
+                left_idx = furthest[offset + diagonal + 1]
+            else:
+                left_idx = furthest[offset + diagonal - 1] + 1
+            right_idx = left_idx - diagonal
+            while left_idx < left_size and right_idx < right_size and left[left_idx] == right[right_idx]:
+                left_idx += 1
+                right_idx += 1
+            furthest[offset + diagonal] = left_idx
+            if left_idx >= left_size and right_idx >= right_size:
+                return _myers_backtrack(trace, left_size, right_size)
+    return None
+
+
+def _myers_backtrack(trace, left_idx, right_idx):
+    """Walk back from the end through the trace of :func:`_myers_blocks`.
+
+    Returns: See :func:`_myers_blocks`
+
+    """
+    result = list()
+    for edits in range(len(trace) - 1, -1, -1):
+        previous = trace[edits]
+        diagonal = left_idx - right_idx
+        if diagonal == -edits or (
+                diagonal != edits and previous[diagonal + edits] < previous[diagonal + edits + 2]):
+            prev_diagonal = diagonal + 1
+        else:
+            prev_diagonal = diagonal - 1
+        prev_left = previous[prev_diagonal + edits + 1]
+        prev_right = prev_left - prev_diagonal
+        size = min(left_idx - prev_left, right_idx - prev_right)
+        if size:
+            left_idx -= size
+            right_idx -= size
+            result.append((left_idx, right_idx, size))
+        left_idx = prev_left
+        right_idx = prev_right
+    result.reverse()
+    return result
+
+
+def _opcodes(left, right, max_edits=1000):
+    """Like SequenceMatcher(None, left, right).get_opcodes() but faster for long similar sequences.
+
+    Common heads and tails are skipped, the rest is compared with the Myers algorithm on
+    integer codes for the items. If that needs more than max_edits edits, SequenceMatcher is used.
+
+    The result is a shortest edit script. SequenceMatcher does not look for the shortest one,
+    so where several alignments are possible (like with repeated positions or moved points),
+    the opcodes may differ from what SequenceMatcher returns.
+
+    Returns:
+        A list of opcodes
+
+    """
+    left_size = len(left)
+    right_size = len(right)
+    head = 0
+    while head < left_size and head < right_size and left[head] == right[head]:
+        head += 1
+    tail = 0
+    while (tail < left_size - head and tail < right_size - head
+           and left[left_size - tail - 1] == right[right_size - tail - 1]):
+        tail += 1
+    codes = dict()
+    left_codes = [codes.setdefault(x, len(codes)) for x in left[head:left_size - tail]]
+    right_codes = [codes.setdefault(x, len(codes)) for x in right[head:right_size - tail]]
+    blocks = _myers_blocks(left_codes, right_codes, max_edits)
+    if blocks is None:
+        return SequenceMatcher(None, left, right).get_opcodes()
+    blocks = [(0, 0, head)] + [(x + head, y + head, size) for x, y, size in blocks]
+    blocks.append((left_size - tail, right_size - tail, tail))
+    result = list()
+    left_idx = right_idx = 0
+    for left_start, right_start, size in blocks:
+        tag = None
+        if left_idx < left_start and right_idx < right_start:
+            tag = 'replace'
+        elif left_idx < left_start:
+            tag = 'delete'
+        elif right_idx < right_start:
+            tag = 'insert'
+        if tag:
+            result.append((tag, left_idx, left_start, right_idx, right_start))
+        left_idx = left_start + size
+        right_idx = right_start + size
+        if size:
+            if not tag and result and result[-1][0] == 'equal':
+                _, left_start, _, right_start, _ = result.pop()
+            result.append(('equal', left_start, left_idx, right_start, right_idx))
+    return result
+
+
 class BackendDiff:
 
     """Compares two backends.directory.
@@ -110,8 +231,7 @@ class BackendDiff:
 
             left_times, left_positions = lists(self.left)
             right_times, right_positions = lists(self.right)
-            for tag, left_start, left_end, right_start, right_end in SequenceMatcher(
-                    None, left_positions, right_positions).get_opcodes():
+            for tag, left_start, left_end, right_start, right_end in _opcodes(left_positions, right_positions):
                 left_found = left_positions[left_start:left_end]
                 right_found = right_positions[right_start:right_end]
                 for idx, _ in enumerate(left_found):
@@ -177,6 +297,7 @@ class BackendDiff:
             """See class docstring."""
             self.gpxfiles = list(self.flatten(gpxfiles))
             self.build_positions()
+            self.digests = [self.digest(x) for x in self.gpxfiles]
             self.exclusive = []
 
         @staticmethod
@@ -201,31 +322,81 @@ class BackendDiff:
             for _ in self.gpxfiles:
                 _.positions = {(x.longitude, x.latitude) for x in _.points()}
 
+        def position_index(self):
+            """Where do positions appear.
+
+            Returns:
+                A dict with (long, lat) as key and a list of indices into gpxfiles as value
+
+            """
+            result = defaultdict(list)
+            for idx, _ in enumerate(self.gpxfiles):
+                for position in _.positions:
+                    result[position].append(idx)
+            return result
+
+        @staticmethod
+        def digest(gpxfile) ->str:
+            """A digest over the positions with 5 digits and over :meth:`GpxFile.key() <gpxity.gpxfile.GpxFile.key>`.
+
+            Returns: The hex digest
+
+            """
+            result = hashlib.sha1(gpxfile.key().encode())
+            columns = gpxfile.gpx.point_columns(fresh=True)
+            for _ in (columns.longitude, columns.latitude):
+                result.update(numpy.round(_, 5).tobytes())
+            return result.hexdigest()
+
         def _find_exclusives(self, matched):
-            """use data from the other side."""
+            """use data from the other side.
+
+            Args:
+                matched: A set with the id() of all matched gpxfiles
+
+            """
             for _ in self.gpxfiles:
-                if _ not in matched:
+                if id(_) not in matched:
                     self.exclusive.append(_)
 
     def __init__(self, left, right):
         """See class docstring."""
+        # pylint: disable=too-many-locals
         self.similar = []
         self.identical = []
-        matched = []
+        matched = set()
         self.left = BackendDiff.BackendDiffSide(left)
         self.right = BackendDiff.BackendDiffSide(right)
-        # pylint: disable=too-many-nested-blocks
-        for left_track in self.left.gpxfiles:
-            for right_track in self.right.gpxfiles:
-                if left_track == right_track:
+        left_tracks = self.left.gpxfiles
+        right_tracks = self.right.gpxfiles
+        # Only pairs with the same digest, sharing positions or with compatible
+        # bounds can be identical or similar, all others are not compared.
+        # The digest rounds positions, so identical still needs ==.
+        by_digest = defaultdict(list)
+        for idx, _ in enumerate(self.right.digests):
+            by_digest[_].append(idx)
+        by_position = self.right.position_index()
+        without_positions = [idx for idx, x in enumerate(right_tracks) if not x.positions]
+        bounds = BoundsIndex([x.gpx.point_columns(fresh=True) for x in left_tracks + right_tracks], digits=5)
+        for left_idx, left_track in enumerate(left_tracks):
+            same_digest = set(by_digest.get(self.left.digests[left_idx], ()))
+            maybe_equal = bounds.equal(left_idx)[len(left_tracks):]
+            shared = Counter()
+            for position in left_track.positions:
+                shared.update(by_position.get(position, ()))
+            candidates = same_digest | set(shared) | {int(x) for x in numpy.flatnonzero(maybe_equal)}
+            if not left_track.positions:
+                candidates.update(without_positions)
+            for right_idx in sorted(candidates):
+                right_track = right_tracks[right_idx]
+                if (right_idx in same_digest or maybe_equal[right_idx]) and left_track == right_track:
                     self.identical.append(left_track)
-                    matched.append(left_track)
-                    matched.append(right_track)
                 else:
                     maxlen = max(len(left_track.positions), len(right_track.positions))
-                    if len(left_track.positions & right_track.positions) >= maxlen * 0.9:
-                        self.similar.append(BackendDiff.Pair(left_track, right_track))
-                        matched.append(left_track)
-                        matched.append(right_track)
+                    if shared[right_idx] < maxlen * 0.9:
+                        continue
+                    self.similar.append(BackendDiff.Pair(left_track, right_track))
+                matched.add(id(left_track))
+                matched.add(id(right_track))
         self.left._find_exclusives(matched)
         self.right._find_exclusives(matched)
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2019 Wolfgang Rohdewald <wolfgang@rohdewald.de>
+# See LICENSE for details.
+
+"""This module defines :class:`~gpxity.geocache.GeoCache`."""
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import geocoder
+from geocoder.location import Location as Geocoder_location
+
+__all__ = ['GeoCache', 'Place']
+
+
+Place = namedtuple('Place', 'lat lng address')
+
+
+class GeoCache:
+
+    """A persistent cache for geocoder lookups with provider osm.
+
+    Reverse lookups are keyed by the position rounded to :attr:`digits`,
+    forward lookups by the place string. Entries older than :attr:`max_age`
+    are looked up again. If there are more than :attr:`max_entries`, the
+    least recently used ones are removed.
+
+    Lookups not in the cache go to :attr:`resolver` or :attr:`forward_resolver`,
+    together at most one every :attr:`min_interval` seconds. Failed lookups (like a network error) are not cached,
+    :meth:`reverse` returns :attr:`failed` for them.
+    If the cache cannot be used (like in a read-only directory), it is
+    silently disabled and all lookups go to the provider.
+
+    Args:
+        path: The sqlite file. Default is :attr:`path`
+
+    Attributes:
+        path: The default for arg path
+        offline: If True, never ask the provider. Reverse lookups not in the cache
+            return :attr:`failed`, forward lookups return None.
+        hits: The number of lookups found in the cache
+        misses: The number of lookups not found in the cache
+        resolver: A function(latitude, longitude) returning what :meth:`reverse` returns.
+            It raises :class:`LookupFailed` if the result should not be cached.
+            Default is :meth:`osm_reverse`.
+        forward_resolver: A function(place) returning [latitude, longitude, address] or None.
+            It raises :class:`LookupFailed` if the result should not be cached.
+            Default is :meth:`osm_forward`.
+        min_interval: Seconds between two calls to :attr:`resolver`, osm allows one request per second
+        max_workers: The upper limit for parallel lookups in :meth:`reverse_many`
+        failed: Returned by :meth:`reverse` if the lookup failed. This is not None
+            because None means the provider knows nothing about the place.
+
+    """
+
+    class LookupFailed(Exception):
+
+        """The resolver could not answer."""
+
+    path = '~/.cache/Gpxity/geocoder.sqlite'
+    digits = 4
+    max_entries = 50000
+    max_age = 180 * 86400  # seconds
+    min_interval = 1.0
+    max_workers = 4
+    failed = object()
+
+    __shared = None
+    __shared_lock = threading.Lock()
+
+    def __init__(self, path=None):
+        """See class docstring."""
+        self.path = os.path.expanduser(path or GeoCache.path)
+        self.offline = False
+        self.hits = 0
+        self.misses = 0
+        self.__db = None
+        self.__disabled = False
+        self.__lock = threading.Lock()
+        self.__inserted = 0
+        self.resolver = GeoCache.osm_reverse
+        self.forward_resolver = GeoCache.osm_forward
+        self.__throttle_lock = threading.Lock()
+        self.__next_request = 0.0
+
+    @classmethod
+    def shared(cls):
+        """The instance used by :class:`~gpxity.gpx.Gpx` and :class:`~gpxity.locate.Locate`.
+
+        Returns: GeoCache
+
+        """
+        with cls.__shared_lock:
+            if cls.__shared is None:
+                cls.__shared = cls()
+            return cls.__shared
+
+    def __disable(self, exc):
+        """Something went wrong, do not use the cache anymore."""
+        logging.warning('%s: disabling the geocoder cache: %s', self.path, exc)
+        self.__disabled = True
+
+    def __execute(self, cmd, args=()):
+        """Execute an SQL command. The caller must hold the lock.
+
+        Returns: A list with the resulting rows or None
+
+        """
+        if self.__disabled:
+            return None
+        try:
+            if self.__db is None:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self.__db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+                self.__db.execute(
+                    'create table if not exists entries('
+                    'key text primary key, value text, stored real, used real)')
+                self.__db.execute('create index if not exists entries_used on entries(used)')
+            return self.__db.execute(cmd, args).fetchall()
+        except (sqlite3.Error, OSError) as exc:
+            self.__disable(exc)
+            return None
+
+    def __get(self, key):
+        """Look up key.
+
+        Returns: (True, value) or (False, None)
+
+        """
+        now = time.time()
+        with self.__lock:
+            rows = self.__execute('select value, stored from entries where key=?', (key, ))
+            if rows and rows[0][1] > now - self.max_age:
+                self.__execute('update entries set used=? where key=?', (now, key))
+                self.hits += 1
+                return True, json.loads(rows[0][0])
+            self.misses += 1
+            return False, None
+
+    def __put(self, key, value):
+        """Store value for key."""
+        now = time.time()
+        with self.__lock:
+            self.__execute('insert or replace into entries values(?,?,?,?)', (key, json.dumps(value), now, now))
+            self.__inserted += 1
+            if self.__inserted % 100 == 1:
+                self.__evict()
+
+    def __evict(self):
+        """Remove expired entries and the least recently used ones. The caller must hold the lock."""
+        self.__execute('delete from entries where stored <= ?', (time.time() - self.max_age, ))
+        rows = self.__execute('select count(*) from entries')
+        if rows and rows[0][0] > self.max_entries:
+            self.__execute(
+                'delete from entries where key in (select key from entries order by used limit ?)',
+                (rows[0][0] - self.max_entries, ))
+
+    def clear(self):
+        """Remove all entries."""
+        with self.__lock:
+            self.__execute('delete from entries')
+
+    @staticmethod
+    def osm_reverse(latitude: float, longitude: float):
+        """The default resolver, asking osm.
+
+        Returns: See :meth:`reverse`
+
+        """
+        place = geocoder.get(location=Geocoder_location([latitude, longitude]), provider='osm', method='reverse')
+        if place.raw is None:
+            if place.status == 'ERROR - No results found':
+                return None
+            raise GeoCache.LookupFailed(place.status)
+        fields = dict()
+        for _ in ('city', 'town', 'village', 'hamlet'):
+            if hasattr(place, _):
+                value = getattr(place, _)
+                if value:
+                    fields[_] = value
+        if 'address' in place.raw:
+            fields.update(place.raw['address'])
+        return {
+            'fields': fields, 'address': place.address,
+            'country': place.country, 'country_code': place.country_code}
+
+    @staticmethod
+    def osm_forward(place: str):
+        """The default forward resolver, asking osm.
+
+        Returns: [latitude, longitude, address] or None
+
+        """
+        result = geocoder.get(place, provider='osm')
+        if not result:
+            if result.status == 'ERROR - No results found':
+                return None
+            raise GeoCache.LookupFailed(result.status)
+        return [result[0].lat, result[0].lng, result[0].address]
+
+    def __throttle(self):
+        """Wait until the provider may be asked again."""
+        with self.__throttle_lock:
+            now = time.monotonic()
+            wait = self.__next_request - now
+            self.__next_request = max(now, self.__next_request) + self.min_interval
+        if wait > 0:
+            time.sleep(wait)
+
+    def __resolve(self, resolver, *args):
+        """Ask the resolver.
+
+        Returns: (True, result) or (False, :attr:`failed`) if the lookup failed
+
+        """
+        self.__throttle()
+        try:
+            return True, resolver(*args)
+        except GeoCache.LookupFailed as exc:
+            logging.warning('Geocoding %s failed: %s', ','.join(str(x) for x in args), exc)
+            return False, self.failed
+
+    def reverse(self, latitude: float, longitude: float):
+        """What is at this position.
+
+        Args:
+            latitude, longitude: The position
+
+        Returns: None if the provider knows nothing (like for water), :attr:`failed` if the
+            lookup failed. Otherwise a dict with
+
+            - fields: A dict with city, town, village, hamlet and the fields from the address
+            - address: The full address
+            - country, country_code: The country
+
+        """
+        return self.reverse_many([(latitude, longitude)])[0]
+
+    def reverse_many(self, positions, workers: int = None):
+        """Like :meth:`reverse` for many positions.
+
+        Positions with the same key are only looked up once. Lookups not in the cache
+        are done in parallel.
+
+        Args:
+            positions: A list of (latitude, longitude)
+            workers: The maximum number of parallel lookups. Default and upper limit is :attr:`max_workers`
+
+        Returns: A list with a result for every position
+
+        """
+        keys = list()
+        results = dict()
+        todo = dict()
+        for latitude, longitude in positions:
+            latitude = round(float(latitude), self.digits)
+            longitude = round(float(longitude), self.digits)
+            key = 'reverse:{},{}'.format(latitude, longitude)
+            keys.append(key)
+            if key in results or key in todo:
+                continue
+            found, result = self.__get(key)
+            if found:
+                results[key] = result
+            elif self.offline:
+                results[key] = self.failed
+            else:
+                todo[key] = (latitude, longitude)
+        if todo:
+            workers = max(1, min(workers or self.max_workers, self.max_workers, len(todo)))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                lookups = executor.map(lambda x: self.__resolve(self.resolver, *x), todo.values())
+                for key, (resolved, result) in zip(todo, lookups):
+                    if resolved:
+                        self.__put(key, result)
+                    results[key] = result
+        return [results[x] for x in keys]
+
+    def forward(self, place: str):
+        """Where is place.
+
+        Args:
+            place: What to look for
+
+        Returns: :class:`Place` or None
+
+        """
+        key = 'forward:{}'.format(place)
+        found, result = self.__get(key)
+        if not found:
+            if self.offline:
+                return None
+            resolved, result = self.__resolve(self.forward_resolver, place)
+            if not resolved:
+                return None
+            self.__put(key, result)
+        return Place(*result) if result else None
@@ -7,9 +7,14 @@
 """This module defines :class:`~gpxity.gpx`."""
 
 from math import asin, sqrt, degrees
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
 import datetime
+import io
 import logging
 
+import numpy
+
 from lxml import etree
 
 # This code would speed up parsing GPX by about 30%. When doing
@@ -19,14 +24,15 @@ from lxml import etree
 # mod_gpxfield.TIME_TYPE=None
 
 from gpxpy import gpx as mod_gpx
+from gpxpy import gpxfield as mod_gpxfield
 from gpxpy import parse as gpxpy_parse
-from gpxpy.geo import length as gpx_length, Location
+from gpxpy.geo import Location
+from gpxpy.geo import distance_from_line
 from gpxpy.geo import simplify_polyline
 
-import geocoder
-from geocoder.location import Location as Geocoder_location
-
-from .util import repr_timespan, uniq, positions_equal
+from .util import repr_timespan, uniq
+from .columns import PointColumns
+from .geocache import GeoCache
 
 GPX = mod_gpx.GPX
 GPXTrack = mod_gpx.GPXTrack
@@ -42,6 +48,310 @@ Location.__hash__ = lambda x: int(x.latitude * 1000) + int(x.longitude * 1000) +
 __all__ = ['Gpx']
 
 
+class _Unsupported(Exception):
+
+    """The streaming parser cannot handle this, gpxpy must do it."""
+
+
+def _stream_parse(indata):
+    """Parse with lxml.etree.iterparse.
+
+    Track points with no other children than ele, time and name are
+    converted while lxml builds the tree and are then removed from it.
+    gpxpy only has to parse the remaining small skeleton.
+
+    Args:
+        indata: str, bytes or a binary file object
+
+    Returns: GPX
+
+    """
+    # pylint: disable=too-many-locals
+    encoding = None
+    if isinstance(indata, str):
+        indata = indata.encode('utf-8')
+        encoding = 'utf-8'  # overrides the declaration in the xml header
+    if isinstance(indata, bytes):
+        indata = io.BytesIO(indata)
+    parse_time = mod_gpxfield.TIME_TYPE.from_string
+    segment_points = dict()
+    context = etree.iterparse(
+        indata, events=('end',), tag='{*}trkpt', encoding=encoding, remove_comments=True, strip_cdata=False)
+    try:
+        for _, element in context:
+            prefix = element.tag[:-len('trkpt')]
+            values = dict()
+            for child in element:
+                if child.text is None and not len(child) and not child.attrib:
+                    # like <link ></link> as written by older gpxpy
+                    continue
+                tag = child.tag[len(prefix):]
+                if not child.tag.startswith(prefix) or tag not in ('ele', 'time', 'name') or tag in values:
+                    raise _Unsupported()
+                values[tag] = child.text
+            try:
+                point = GPXTrackPoint(
+                    float(element.get('lat')), float(element.get('lon')),
+                    name=values.get('name'))
+                if values.get('ele') is not None:
+                    point.elevation = float(values['ele'].strip())
+            except (TypeError, ValueError):
+                raise _Unsupported()
+            if values.get('time') is not None:
+                point.time = parse_time(values['time'])
+                if point.time is not None and point.time.tzinfo is None:
+                    point.time = point.time.replace(tzinfo=datetime.timezone.utc)
+            parent = element.getparent()
+            if parent not in segment_points:
+                segment_points[parent] = list()
+            segment_points[parent].append(point)
+            parent.remove(element)
+    except etree.XMLSyntaxError as exc:
+        raise GPXXMLSyntaxException('Error parsing XML: {}'.format(exc), exc)
+    root = context.root
+    result = gpxpy_parse(etree.tostring(root, encoding='unicode'))
+    for track, trk in zip(result.tracks, root.findall('{*}trk')):
+        for segment, trkseg in zip(track.segments, trk.findall('{*}trkseg')):
+            segment.points = segment_points.pop(trkseg, list())
+    if segment_points:
+        # trkpt outside of trk/trkseg
+        raise _Unsupported()
+    return result
+
+
+class _TimeOfDayIndex:
+
+    """The remaining points for :meth:`Gpx.fix_orux`, sorted by time of day.
+
+    Removed points are skipped with path compressed links, so finding the
+    nearest remaining point in time normally only looks at a few points.
+
+    Args:
+        points: A list of points with the attribute hhmmss
+
+    """
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, points):
+        """See class docstring."""
+        self.points = points
+        self.removed = [False] * len(points)
+        self.remaining = len(points)
+        self.__order = sorted(range(len(points)), key=lambda x: (points[x].hhmmss, x))
+        self.__keys = [points[x].hhmmss for x in self.__order]
+        self.__position = [0] * len(points)
+        for position, idx in enumerate(self.__order):
+            self.__position[idx] = position
+        # __next[pos] == pos for remaining points, the last entry is a sentinel.
+        # __prev is shifted by one: __prev[pos + 1] is for pos, __prev[0] is a sentinel.
+        self.__next = list(range(len(points) + 1))
+        self.__prev = list(range(len(points) + 1))
+
+    @staticmethod
+    def __find(links, pos):
+        """Follow links until a remaining point or a sentinel.
+
+        Returns: The position found
+
+        """
+        root = pos
+        while links[root] != root:
+            root = links[root]
+        while links[pos] != root:
+            links[pos], pos = root, links[pos]
+        return root
+
+    def __next_remaining(self, pos):
+        """The next remaining position at or after pos, wrapping around.
+
+        Returns: The position
+
+        """
+        result = self.__find(self.__next, pos)
+        if result == len(self.points):
+            result = self.__find(self.__next, 0)
+        return result
+
+    def __prev_remaining(self, pos):
+        """The next remaining position at or before pos, wrapping around.
+
+        Returns: The position
+
+        """
+        result = self.__find(self.__prev, pos + 1) - 1
+        if result < 0:
+            result = self.__find(self.__prev, len(self.points)) - 1
+        return result
+
+    def remove(self, idx):
+        """Remove points[idx]."""
+        pos = self.__position[idx]
+        self.removed[idx] = True
+        self.remaining -= 1
+        self.__next[pos] = pos + 1
+        self.__prev[pos + 1] = pos
+
+    def nearest(self, last_point, is_near, time_diff, max_diff):
+        """Find the point with the smallest time_diff, preferring near points.
+
+        This gives the same result as min() over the remaining points in their
+        original order. time_diff must grow with the distance in time of day up to max_diff.
+
+        Args:
+            last_point: The point to compare with
+            is_near: is_near(last_point, point) filters
+            time_diff: time_diff(last_point, point) is the sort key
+            max_diff: Beyond this, time_diff is not monotonous
+
+        Returns: The index into points
+
+        """
+        size = len(self.points)
+        start = bisect_left(self.__keys, last_point.hhmmss) % size
+        sides = [self.__next_remaining(start), self.__prev_remaining((start - 1) % size)]
+        diffs = [time_diff(last_point, self.points[self.__order[x]]) for x in sides]
+        steps = (self.__next_remaining, self.__prev_remaining)
+        is_open = [True, True]
+        best = best_diff = None
+        visited = 0
+        while visited < self.remaining and any(is_open):
+            side = 0 if is_open[0] and (not is_open[1] or diffs[0] <= diffs[1]) else 1
+            if diffs[side] > max_diff or (best is not None and diffs[side] > best_diff):
+                is_open[side] = False
+                continue
+            visited += 1
+            idx = self.__order[sides[side]]
+            if is_near(last_point, self.points[idx]) and (
+                    best is None or diffs[side] < best_diff or (diffs[side] == best_diff and idx < best)):
+                best = idx
+                best_diff = diffs[side]
+            sides[side] = steps[side]((sides[side] + (1 if side == 0 else -1)) % size)
+            diffs[side] = time_diff(last_point, self.points[self.__order[sides[side]]])
+        if best is None:
+            # nothing near and in time, look at everything
+            candidates = [x for x in range(size) if not self.removed[x]]
+            near = [x for x in candidates if is_near(last_point, self.points[x])]
+            best = min(near or candidates, key=lambda x: time_diff(last_point, self.points[x]))
+        return best
+
+
+def _significance(points):
+    """The significance of every point for the Ramer-Douglas-Peucker algorithm.
+
+    This does the same as gpxpy simplify_polyline, but only once: simplify_polyline
+    with max_distance keeps exactly the points with a significance of at least
+    max_distance. The significance of a point is its distance from the line,
+    but not more than the significance of the point which split the line.
+
+    So many points get the significance of their parent. Sorting by significance and
+    then by order never puts a point before the point which split its line.
+
+    Args:
+        points: A list of points
+
+    Returns: A tuple with two numpy arrays:
+        - significance: meters, inf for the first and the last point
+        - order: The order in which the points split their line, 0 for the first and the last point
+
+    """
+    size = len(points)
+    result = numpy.full(size, numpy.inf)
+    order = numpy.zeros(size, dtype=int)
+    splits = 0
+    latitude = numpy.fromiter((x.latitude for x in points), float, size)
+    longitude = numpy.fromiter((x.longitude for x in points), float, size)
+    todo = [(0, size - 1, numpy.inf)]
+    while todo:
+        first, last, limit = todo.pop()
+        if last - first < 2:
+            continue
+        # like simplify_polyline, find the most distant point on a flat earth
+        if longitude[first] == longitude[last]:
+            flat = numpy.abs(longitude[first + 1:last] - longitude[first])
+        else:
+            slope = (latitude[first] - latitude[last]) / (longitude[first] - longitude[last])
+            offset = latitude[first] - longitude[first] * slope
+            flat = numpy.abs(latitude[first + 1:last] - slope * longitude[first + 1:last] - offset)
+        middle = first + 1 + int(flat.argmax())
+        distance = distance_from_line(points[middle], points[first], points[last])
+        if distance is not None:
+            limit = min(distance, limit)
+        result[middle] = limit
+        splits += 1
+        order[middle] = splits
+        todo.append((first, middle, limit))
+        todo.append((middle, last, limit))
+    return result, order
+
+
+class _PointData:
+
+    """Per point quantities for :meth:`Gpx.untangle`, as numpy arrays.
+
+    The first and the last point get the values of their neighbours.
+
+    Args:
+        gpx: The Gpx
+
+    Attributes:
+        points: :meth:`Gpx.point_list`
+        turn: The change of direction in degrees 0..180
+        way_before, way_after: Meters
+        time_before, time_after: Seconds
+        speed_before, speed_after: km/h
+        weight: Combines speed and turn
+
+    """
+
+    # pylint: disable=too-few-public-methods,too-many-instance-attributes
+
+    def __init__(self, gpx):
+        """See class docstring."""
+        self.points = gpx.point_list()
+        self.__index = None
+        columns = gpx.point_columns()
+        size = columns.size
+        way = columns.distances(forward=True)
+        times = columns.time
+        timediff = times[1:] - times[:-1]
+        identical = numpy.flatnonzero(timediff == 0)
+        if len(identical):
+            raise Exception('{} has two adjacent points with identical time {}'.format(
+                gpx, self.points[identical[0]].time))
+        # simulate high speed, so those points are kept
+        timediff[numpy.isnan(timediff)] = 0.001
+        speed = numpy.round(way / timediff * 3.6, 2)
+
+        # index into the arrays between points
+        after = numpy.minimum(numpy.arange(size), size - 2)
+        before = numpy.maximum(numpy.arange(size) - 1, 0)
+        before[-1] = after[-1] = max(size - 3, 0)
+        self.way_before, self.way_after = way[before], way[after]
+        self.time_before, self.time_after = timediff[before], timediff[after]
+        self.speed_before, self.speed_after = speed[before], speed[after]
+
+        # Since this is done to find points within the same ball, identical positions
+        # should return a big degree. Both big turns and identical positions are parts of a ball.
+        # formula 2 at https://en.wikipedia.org/wiki/Law_of_cosines#Applications is problematic.
+        self.turn = numpy.zeros(size, dtype=int)
+        angles = columns.angles()
+        short = numpy.round(way) < 5
+        self.turn[1:-1] = numpy.where(
+            short[:-1] | short[1:], 100, numpy.abs(numpy.round((angles[:-1] - angles[1:] + 180) % 360 - 180)))
+        self.weight = numpy.round(self.speed_after * 5 - self.turn, 2)
+
+    def index(self, point) ->int:
+        """The index of point in :attr:`points`.
+
+        Returns: The index or None
+
+        """
+        if self.__index is None:
+            self.__index = {id(x): idx for idx, x in enumerate(self.points)}
+        return self.__index.get(id(point))
+
+
 class Gpx(GPX):
 
     """Wrapper around class GPX from gpxpy.
@@ -73,6 +383,10 @@ class Gpx(GPX):
 
     undefined_str = '__UXNXDXEXFXIXNXEXD__'
     undefined_date = datetime.datetime(year=1970, month=1, day=3, hour=1, tzinfo=datetime.timezone.utc)
+
+    # fix_orux: time differences in seconds up to this value are compared directly
+    __max_time_diff = 33200
+
     _seg_wpt_prefix = 'Trk/Seg '
 
     def __init__(self):
@@ -83,6 +397,12 @@ class Gpx(GPX):
         self.keywords = Gpx.undefined_str
         self.time = Gpx.undefined_date
         self.__cached_speed = None
+        self.__cached_columns = None
+        self.__cached_flat = None
+        self.__cached_fences = None
+        self.__cached_fingerprint = None
+        self.__running = None  # (signature, length in meters), see add_points
+        self.__point_data = None  # only during untangle
         self.default_country = None
 
         self.real_keywords = list()
@@ -126,9 +446,21 @@ class Gpx(GPX):
             if self.description == Gpx.undefined_str:
                 self.description = ''
 
-    def decode(self):
-        """Extract real_keywords, category, public,ids from keywords."""
+    def decode(self, appended: bool = False):
+        """Extract real_keywords, category, public,ids from keywords.
+
+        Args:
+            appended: Points were only changed by :meth:`add_points` since the last decode.
+                The cached point data stays valid.
+
+        """
         self.__cached_speed = None
+        if not appended:
+            self.__cached_columns = None
+            self.__cached_flat = None
+            self.__cached_fences = None
+            self.__cached_fingerprint = None
+            self.__running = None
         self.__update_segment_waypoints()
         if self.keywords is None:
             self.keywords = ''
@@ -191,22 +523,54 @@ class Gpx(GPX):
             the distance in km, rounded to m. 0.0 if not computable.  # TODO: needs unittest
 
         """
-        return round(gpx_length(list(self.points())) / 1000, 3)
+        return round(self.__length() / 1000, 3)
+
+    def __length(self) ->float:
+        """The 2d length in meters, updated by :meth:`add_points`.
+
+        Returns: float
+
+        """
+        signature = self.__segment_signature()
+        if self.__running is None or not self.__same_signature(self.__running[0], signature):
+            self.__running = (signature, self.point_columns().length())
+        return self.__running[1]
 
     def add_points(self, points):
-        """Just add points. Silently ignore points which are allready in this Gpx."""
+        """Just add points. Silently ignore points which are allready in this Gpx.
+
+        The length and the cache for :meth:`point_list` are updated with
+        the new points only, so appending costs O(len(points)).
+
+        """
         if points:
+            points = list(points)
             if not self.tracks:
                 self.tracks.append(GPXTrack())
                 self.tracks[0].segments.append(GPXTrackSegment())
-            self.tracks[-1].segments[-1].points.extend(points)
+            old_signature = self.__segment_signature()
+            segment_points = self.tracks[-1].segments[-1].points
+            previous = segment_points[-1:]
+            segment_points.extend(points)
+            signature = self.__segment_signature()
+            if self.__running is not None and self.__same_signature(self.__running[0], old_signature):
+                added = PointColumns.from_points(previous + points).length()
+                self.__running = (signature, self.__running[1] + added)
+            if self.__cached_flat is not None and self.__same_signature(self.__cached_flat[0], old_signature):
+                _, flat_points, offsets, locations = self.__cached_flat
+                flat_points.extend(points)
+                self.__cached_flat = (signature, flat_points, offsets, locations)
 
     @classmethod
     def parse(cls, indata, is_complete: bool = True):
         """Parse xml data.
 
+        A streaming parser handles the track points. If it finds something
+        it does not understand, gpxpy parses everything.
+
         Args:
-            indata: may be a file descriptor or str
+            indata: may be a file descriptor, str or bytes. Seekable binary files
+                are parsed while reading.
             is_complete: indata holds the entire gpxfile info, not just metadata
 
         Returns: Gpx()
@@ -215,11 +579,23 @@ class Gpx(GPX):
         result = Gpx()
         result.is_complete = is_complete
         if hasattr(indata, 'read'):
-            indata = indata.read()
+            if not (isinstance(indata, io.BufferedIOBase) and indata.seekable()):
+                indata = indata.read()
+            elif not indata.read(1):
+                indata = None
+            else:
+                indata.seek(0)
         if indata:
             # gpxpy.gpx has no classmethod constructor. This should be simpler.
             try:
-                gpx = gpxpy_parse(indata)
+                try:
+                    gpx = _stream_parse(indata)
+                    points_have_tzinfo = True
+                except _Unsupported:
+                    if hasattr(indata, 'seek'):
+                        indata.seek(0)
+                    gpx = gpxpy_parse(indata)
+                    points_have_tzinfo = False
             except GPXXMLSyntaxException as exc:
                 logging.error('GPX Syntax error in %s: %s', indata, exc)
                 raise
@@ -231,7 +607,10 @@ class Gpx(GPX):
                 result.name = ''
             if result.description is None:
                 result.description = ''
-        result._add_missing_tzinfo()  # pylint: disable=protected-access
+            if not points_have_tzinfo:
+                result._add_missing_tzinfo()  # pylint: disable=protected-access
+        if result.time and not result.time.tzinfo:
+            result.time = result.time.replace(tzinfo=datetime.timezone.utc)
         return result
 
     def _add_missing_tzinfo(self):
@@ -322,7 +701,7 @@ class Gpx(GPX):
         duration = time_range[1] - time_range[0]
         seconds = duration.days * 24 * 3600 + duration.seconds
         if seconds:
-            return round(gpx_length(self.point_list()) / seconds * 3.6, 3)
+            return round(self.__length() / seconds * 3.6, 3)
         return 0.0
 
     def moving_speed(self) ->float:
@@ -431,14 +810,158 @@ class Gpx(GPX):
             for point in segment.points:
                 yield point
 
+    def __segment_signature(self):
+        """Identify the current point lists.
+
+        Returns: A list with (track_idx, segment_idx, points, len(points)) for all segments
+
+        """
+        return [
+            (track_idx, segment_idx, segment.points, len(segment.points))
+            for track_idx, track in enumerate(self.tracks)
+            for segment_idx, segment in enumerate(track.segments)]
+
+    @staticmethod
+    def __same_signature(old, new) ->bool:
+        """Check if the segment structure is unchanged since old was taken.
+
+        Returns: True or False
+
+        """
+        return len(old) == len(new) and all(
+            old_seg[2] is new_seg[2] and old_seg[:2] == new_seg[:2] and old_seg[3] == new_seg[3]
+            for old_seg, new_seg in zip(old, new))
+
+    def __flat_points(self):
+        """The cached flat point list and the segment offset table.
+
+        Returns: (points, offsets, locations). offsets[x] is the index of the first point
+            of the segment at locations[x] = (track_idx, segment_idx) in points.
+
+        """
+        signature = self.__segment_signature()
+        if self.__cached_flat is None or not self.__same_signature(self.__cached_flat[0], signature):
+            points = list()
+            offsets = list()
+            for _ in signature:
+                offsets.append(len(points))
+                points.extend(_[2])
+            self.__cached_flat = (signature, points, offsets, [x[:2] for x in signature])
+        return self.__cached_flat[1:]
+
     def point_list(self):
         """A flat list with all points.
 
+        This is a new list, copied from a cache which :meth:`add_points` appends to.
+
+        Returns:
+            The list
+
+        """
+        return list(self.__flat_points()[0])
+
+    def _point_list(self):
+        """The cached list behind :meth:`point_list`, without copying it.
+
+        Callers must not change the list.
+
         Returns:
             The list
 
         """
-        return sum((x.points for x in self.segments()), [])
+        return self.__flat_points()[0]
+
+    def point_location(self, idx: int):
+        """Find a point from :meth:`point_list` in the tracks.
+
+        Args:
+            idx: The index into :meth:`point_list`
+
+        Returns: (track_idx, segment_idx, point_idx)
+
+        """
+        points, offsets, locations = self.__flat_points()
+        if idx < 0:
+            idx += len(points)
+        if not 0 <= idx < len(points):
+            raise IndexError('point index {} out of range'.format(idx))
+        segment = bisect_right(offsets, idx) - 1
+        return locations[segment] + (idx - offsets[segment], )
+
+    def point_columns(self, fresh: bool = False) ->PointColumns:
+        """All points as numpy arrays, see :class:`~gpxity.columns.PointColumns`.
+
+        They are built lazily for every segment and cached. The cache is
+        invalidated by :meth:`decode` which happens whenever a
+        :class:`~gpxity.gpxfile.GpxFile` gets dirty with 'gpx'. Segments
+        with a replaced or resized point list are rebuilt automatically.
+
+        Args:
+            fresh: Bypass the cache and build from the current points. Use this
+                if points may have been modified in place.
+
+        Returns: PointColumns
+
+        """
+        if fresh:
+            return PointColumns.concatenate([PointColumns.from_points(x.points) for x in self.segments()])
+        # the cache holds references to the point lists, so their ids stay unique
+        signature = self.__segment_signature()
+        known = dict()
+        if self.__cached_columns is not None:
+            old_signature, old_parts, old_result = self.__cached_columns
+            if self.__same_signature(old_signature, signature):
+                return old_result
+            known = {id(x[2]): part for x, part in zip(old_signature, old_parts) if len(x[2]) == x[3]}
+        parts = [known.get(id(x[2])) or PointColumns.from_points(x[2]) for x in signature]
+        result = PointColumns.concatenate(parts)
+        self.__cached_columns = (signature, parts, result)
+        return result
+
+    def fence_masks(self, fences):
+        """Which points are outside of fences, see :meth:`Fences.mask <gpxity.accounts.Fences.mask>`.
+
+        The masks are cached like :meth:`point_columns`. For segments which
+        only got more points, only the new points are tested.
+
+        Args:
+            fences: :class:`~gpxity.accounts.Fences`
+
+        Returns: A list with a numpy array of bool for every segment, in the order of :meth:`segments`
+
+        """
+        signature = self.__segment_signature()
+        key = str(fences)
+        known = dict()
+        if self.__cached_fences is not None:
+            old_key, old_signature, old_masks = self.__cached_fences
+            if old_key == key:
+                if self.__same_signature(old_signature, signature):
+                    return old_masks
+                known = {id(x[2]): mask for x, mask in zip(old_signature, old_masks)}
+        masks = list()
+        for _ in signature:
+            mask = known.get(id(_[2]))
+            if mask is None or len(mask) > _[3]:
+                mask = fences.mask(_[2])
+            elif len(mask) < _[3]:
+                mask = numpy.concatenate((mask, fences.mask(_[2][len(mask):])))
+            masks.append(mask)
+        self.__cached_fences = (key, signature, masks)
+        return masks
+
+    def fenced_points(self, fences) ->int:
+        """The number of points within fences.
+
+        Args:
+            fences: :class:`~gpxity.accounts.Fences`
+
+        Returns: The number
+
+        """
+        if not fences:
+            return 0
+        return sum(len(x) - int(x.sum()) for x in self.fence_masks(fences))
 
     def last_point(self):
         """Return the last point of the track. None if none."""
@@ -456,11 +979,42 @@ class Gpx(GPX):
 
         """
         super(Gpx, self).adjust_time(delta)
+        self.__cached_columns = None
         for wpt in self.waypoints:
             wpt.time += delta
         if self.time:
             self.time += delta
 
+    def fingerprint(self):
+        """The simplified track used for similarity, see :meth:`fingerprint_similarity`.
+
+        The result is cached like :meth:`point_columns`.
+
+        Returns: (number of simplified points, frozenset with their positions rounded to 3 digits)
+
+        """
+        signature = self.__segment_signature()
+        if self.__cached_fingerprint is None or not self.__same_signature(self.__cached_fingerprint[0], signature):
+            simple = simplify_polyline(list(self.points()), max_distance=50)
+            result = (len(simple), frozenset((round(x.latitude, 3), round(x.longitude, 3)) for x in simple))
+            self.__cached_fingerprint = (signature, result)
+        return self.__cached_fingerprint[1]
+
+    @staticmethod
+    def fingerprint_similarity(left, right) ->float:
+        """Compare two results of :meth:`fingerprint`.
+
+        Returns: A float 0..1: 1 is identity
+
+        """
+        max_len = max(left[0], right[0])
+        min_len = min(len(left[1]), len(right[1]))
+        if not min_len:
+            return 0.0
+        similar_length = 1.0 - abs(left[0] - right[0]) / max_len
+        similar_points = len(left[1] & right[1]) / min_len
+        return similar_length * similar_points
+
     def points_hash(self) -> float:
         """A hash that is hopefully different for every possible Gpx().
 
@@ -470,21 +1024,7 @@ class Gpx(GPX):
             The hash
 
         """
-        result = 1.0
-        for point in self.points():
-            if point.longitude:
-                result *= point.longitude
-            if point.latitude:
-                result *= point.latitude
-            if point.elevation:
-                result *= point.elevation
-            _ = point.first_time
-            if _:
-                result *= (_.hour + 1)
-                result *= (_.minute + 1)
-                result *= (_.second + 1)
-            result %= 1e20
-        return result
+        return float(int(self.point_columns().digest()[:13], 16))
 
     def points_equal(self, other, digits=4) ->bool:
         """
@@ -504,10 +1044,11 @@ class Gpx(GPX):
         if self.get_track_points_no() != other.get_track_points_no():
             logging.debug('Pointcount %s != %s', self.get_track_points_no(), other.get_track_points_no())
             return False
-        for _, (point1, point2) in enumerate(zip(self.points(), other.points())):
-            if not positions_equal(point1, point2, digits):
-                logging.debug('Point #%s: %s != %s', _, point1, point2)
-                return False
+        equal = self.point_columns(fresh=True).positions_close(other.point_columns(fresh=True), digits)
+        if not equal.all():
+            _ = int(equal.argmin())
+            logging.debug('Point #%s: %s != %s', _, self.point_list()[_], other.point_list()[_])
+            return False
         return True
 
     def index(self, other, digits=4):
@@ -525,21 +1066,13 @@ class Gpx(GPX):
             None or the starting index for other.points in self.points
 
         """
-        self_points = self.point_list()
-        other_points = other.point_list()
-        for self_idx in range(len(self_points) - len(other_points) + 1):
-            for other_idx, other_point in enumerate(other_points):
-                if not positions_equal(self_points[self_idx + other_idx], other_point, digits):
-                    break
-            else:
-                return self_idx
-        return None
+        return self.point_columns(fresh=True).index(other.point_columns(fresh=True), digits)
 
     @staticmethod
     def __time_diff(last_point, point):
         """Return difference in seconds, ignoring the date."""
         result = abs(last_point.hhmmss - point.hhmmss)
-        if result > 33200:  # seconds in 12 hours
+        if result > Gpx.__max_time_diff:  # seconds in 12 hours
             result = 86400 - result
         return result
 
@@ -628,19 +1161,20 @@ class Gpx(GPX):
         Returns: True if something changed.
 
         """
-        all_points = list(uniq(self.points()))
+        # points only compare equal to themselves
+        all_points = list(uniq(self.points(), key=id))
         for _ in all_points:
             _.hhmmss = _.time.hour * 3600.0 + _.time.minute * 60
             _.hhmmss += _.time.second + _.time.microsecond / 1000000
-        new_points = list([all_points.pop(0)])
-        while all_points:
-            last_point = new_points[-1]
-            near_points = [x for x in all_points if self.__point_is_near(last_point, x, 10000)]
-            if not near_points:
-                near_points = all_points[:]
-            nearest = min(near_points, key=lambda x: Gpx.__time_diff(last_point, x))
-            new_points.append(nearest)
-            all_points.remove(nearest)
+        remaining = _TimeOfDayIndex(all_points)
+        remaining.remove(0)
+        new_points = list([all_points[0]])
+        while remaining.remaining:
+            nearest = remaining.nearest(
+                new_points[-1], lambda last, x: self.__point_is_near(last, x, 10000),
+                Gpx.__time_diff, Gpx.__max_time_diff)
+            remaining.remove(nearest)
+            new_points.append(all_points[nearest])
 
         day_offset = 0
         point1 = None
@@ -690,54 +1224,72 @@ class Gpx(GPX):
         track or point may also be a real GPXTrackPoint.
 
         Returns: tuple(name, located)
-            name is the name of the location
-            located is True if locating was needed, False if we had it cached
+            name is the name of the location, None if the lookup failed
+            located is True if the point got a name, False if we had it cached
 
         """
-        # pylint: disable=too-many-branches
         if isinstance(track, GPXTrackPoint):
             point = track
         if not isinstance(point, GPXTrackPoint):
             point = self.tracks[track].segments[segment].points[point]
-        result = not point.name
-        if result:
-            # point.name = 'dummy'  # for faster testing
-            # return point.name, True
-            parts = []
-            _ = Geocoder_location([point.latitude, point.longitude])
-            place = geocoder.get(location=_, provider='osm', method='reverse')
-            if place.raw is None:
-                point.name = 'Water'
-                return point.name, True
-            fields = dict()
-            for _ in ('city', 'town', 'village', 'hamlet'):
-                if hasattr(place, _):
-                    value = getattr(place, _)
-                    if value:
-                        fields[_] = value
-            if 'address' in place.raw:
-                fields.update(place.raw['address'])
-            name = None
-            prefer = ['town', 'suburb', 'village', 'hamlet', 'town', 'city', 'school']
-            for _ in prefer:
-                if _ in fields:
-                    name = fields[_]
-                    break
-            if not name:
-                name = place.address
-            if name:
-                parts.append(name)
-            if not self.default_country or place.country.lower() != self.default_country.lower():
-                parts.append(place.country or place.country_code)
-            try:
-                point.name = ','.join(parts)
-            except TypeError:
-                logging.error(
-                    'Parsing geo info: %r country=%r(default %r) -> %r',
-                    place.raw, place.country, self.default_country, parts)
-                raise
+        result = bool(self.locate_points([point]))
         return point.name, result
 
+    def locate_points(self, points) ->int:
+        """Like :meth:`locate_point` for many points.
+
+        The lookups are done in parallel by :meth:`GeoCache.reverse_many <gpxity.geocache.GeoCache.reverse_many>`.
+        If a lookup fails, point.name stays None and the next call tries again.
+
+        Args:
+            points: A list of GPXTrackPoint
+
+        Returns: The number of points which got a name
+
+        """
+        todo = [x for x in points if not x.name]
+        result = 0
+        if todo:
+            places = GeoCache.shared().reverse_many([(x.latitude, x.longitude) for x in todo])
+            for point, place in zip(todo, places):
+                if place is not GeoCache.failed:
+                    point.name = self.__place_name(place)
+                    result += 1
+        return result
+
+    def __place_name(self, place) ->str:
+        """The name of a place found by :class:`~gpxity.geocache.GeoCache`.
+
+        Returns: The name
+
+        """
+        # return 'dummy'  # for faster testing
+        if place is None:
+            return 'Water'
+        parts = []
+        fields = place['fields']
+        name = None
+        prefer = ['town', 'suburb', 'village', 'hamlet', 'town', 'city', 'school']
+        for _ in prefer:
+            if _ in fields:
+                name = fields[_]
+                break
+        if not name:
+            name = place['address']
+        if name:
+            parts.append(name)
+        country = place['country']
+        if not self.default_country or not country or country.lower() != self.default_country.lower():
+            if country or place['country_code']:
+                parts.append(country or place['country_code'])
+        try:
+            return ','.join(parts)
+        except TypeError:
+            logging.error(
+                'Parsing geo info: %r country=%r(default %r) -> %r',
+                place, country, self.default_country, parts)
+            raise
+
     @staticmethod
     def _wpt_equal(left, right):
         """Compare two waypoints.
@@ -799,21 +1351,22 @@ class Gpx(GPX):
             Returns: GPXWaypoint
 
             """
-            self.locate_point(point)
             debug_info = list()
-            if hasattr(point, 'speed_after'):
-                debug_info.append('speed:{}'.format(point.speed_after))
-            if hasattr(point, 'turn'):
-                debug_info.append('turn:{}'.format(point.turn))
+            point_idx = self.__point_data.index(point) if self.__point_data else None
+            if point_idx is not None:
+                debug_info.append('speed:{}'.format(self.__point_data.speed_after[point_idx]))
+                debug_info.append('turn:{}'.format(self.__point_data.turn[point_idx]))
             name = '{}{}/{} {}{}'.format(
                 self._seg_wpt_prefix, trk_idx + 1, seg_idx + 1,
                 ','.join(debug_info),
-                point.name)
+                point.name or '')
             return GPXWaypoint(
                 latitude=point.latitude, longitude=point.longitude,
                 elevation=point.elevation, time=point.time, name=name,
                 symbol='Waypoint', type=typename)
 
+        segments = list(self.segments())
+        self.locate_points([x.points[0] for x in segments] + ([x.points[-1] for x in segments] if at_end else []))
         old_seg_wp = [x for x in self.waypoints if x.name.startswith(self._seg_wpt_prefix)]
         new_seg_wp = list()
         for trk_idx, trk in enumerate(self.tracks):
@@ -945,60 +1498,6 @@ class Gpx(GPX):
         assert False
         return None
 
-    def __prepare_point_data(self):
-        """Prepare point data needed for untangle()."""  # noqa
-        def turn(first, middle, last):
-            """The change of direction at middle point in abs(degrees): 0..180.
-
-            Since this is done to find points within the same ball, identical positions
-            should return a big degree. Both big turns and identical positions are parts of a ball.
-
-            formula 2 at https://en.wikipedia.org/wiki/Law_of_cosines#Applications is problematic.
-
-            Returns: 0..180
-            """
-
-            length_a = first.distance_2d(middle)
-            if round(length_a) < 5:
-                return 100
-            length_b = middle.distance_2d(last)
-            if round(length_b) < 5:
-                return 100
-            angle1 = self.angle(first, middle)
-            angle2 = self.angle(middle, last)
-            return abs(round(((angle1 - angle2) + 180) % 360 - 180))
-
-        self.all_points = self.point_list()  # pylint:disable=attribute-defined-outside-init
-        self.all_points[0].turn = 0
-        self.all_points[-1].turn = 0
-        for idx in range(0, len(self.all_points) - 2):
-            self.all_points[idx + 1].turn = turn(*self.all_points[idx:idx + 3])
-        for idx in range(0, len(self.all_points) - 1):
-            first = self.all_points[idx]
-            second = self.all_points[idx + 1]
-            if not first.time or not second.time:
-                timediff = datetime.timedelta(milliseconds=1)  # simulate high speed, so those points are kept
-            else:
-                timediff = second.time - first.time
-                if not timediff:
-                    raise Exception('{} has two adjacent points with identical time {}'.format(self, first.time))
-            first.time_after = timediff
-            second.time_before = timediff
-            way = first.distance_2d(second)
-            first.way_after = way
-            second.way_before = way
-            first.speed_after = round(way / timediff.total_seconds() * 3.6, 2)  # km/h
-            second.speed_before = first.speed_after
-        for src, dst in ((1, 0), (-2, -1)):
-            self.all_points[dst].way_before = self.all_points[src].way_before
-            self.all_points[dst].way_after = self.all_points[src].way_before
-            self.all_points[dst].time_before = self.all_points[src].time_before
-            self.all_points[dst].time_after = self.all_points[src].time_before
-            self.all_points[dst].speed_before = self.all_points[src].speed_before
-            self.all_points[dst].speed_after = self.all_points[src].speed_before
-        for point in self.all_points:
-            point.weight = round(point.speed_after * 5 - point.turn, 2)
-
     def __remove_single_points(self, force):
         """Remove a point if.
 
@@ -1008,62 +1507,79 @@ class Gpx(GPX):
 
         """
         result = list()
-        avg_time = sum(
-            (x.time_after for x in self.all_points[:-1]),
-            datetime.timedelta()) / (len(self.all_points) - 1)
-        remove_points = list()
-        time_limit = avg_time * 5
-        # for first, middle, after in self._window(self.all_points):
-        for middle in self.all_points:  # TODO: TESTEN
-            if middle.time is None or middle.time_before is None or middle.time_after is None:
-                continue
-            if (middle.time_before > time_limit and middle.time_after > time_limit):
-                if middle.turn > 30 and middle.way_after < 50 and middle.way_before < 50:
-                    remove_points.append(middle)
-
-        for remove_point in reversed(remove_points):
-            self.locate_point(remove_point)
+        data = self.__point_data
+        time_limit = data.time_after[:-1].mean() * 5
+        with numpy.errstate(invalid='ignore'):
+            remove_idx = numpy.flatnonzero(
+                ~numpy.isnan(self.point_columns().time)
+                & (data.time_before > time_limit) & (data.time_after > time_limit)
+                & (data.turn > 30) & (data.way_after < 50) & (data.way_before < 50))
+        self.locate_points([data.points[x] for x in remove_idx])
+        for idx in reversed(remove_idx):
+            remove_point = data.points[idx]
             result.append(
                 'removing point {} {} time before/after {}/{}'.format(
                     remove_point, remove_point.name,
-                    remove_point.time_before, remove_point.time_after))
-            track_idx, seg_idx, point_idx = self.point_index_by_id(remove_point)
-            if force:
-                # split segment after point to be removed
-                self.split_segment_after(track_idx, seg_idx, point_idx)
-                del self.tracks[track_idx].segments[seg_idx].points[point_idx]
+                    datetime.timedelta(seconds=float(data.time_before[idx])),
+                    datetime.timedelta(seconds=float(data.time_after[idx]))))
+        if force and len(remove_idx):
+            self.__remove_points_splitting([self.point_location(int(x)) for x in remove_idx])
         # remove empty segments
         if force:
             for track in self.tracks:
                 track.segments = [x for x in track.segments if x.points]
         return result
 
+    def __remove_points_splitting(self, locations):
+        """Remove points, splitting their segments where they were.
+
+        Args:
+            locations: A list with (track_idx, segment_idx, point_idx)
+
+        """
+        removed = defaultdict(set)
+        for track_idx, seg_idx, point_idx in locations:
+            removed[(track_idx, seg_idx)].add(point_idx)
+        for track_idx, track in enumerate(self.tracks):
+            new_segments = list()
+            for seg_idx, segment in enumerate(track.segments):
+                indices = removed.get((track_idx, seg_idx))
+                if not indices:
+                    new_segments.append(segment)
+                    continue
+                pieces = [[]]
+                for point_idx, point in enumerate(segment.points):
+                    if point_idx in indices:
+                        pieces.append([])
+                    else:
+                        pieces[-1].append(point)
+                pieces = [x for x in pieces if x] or [[]]
+                segment.points = pieces[0]
+                new_segments.append(segment)
+                for piece in pieces[1:]:
+                    new_segments.append(GPXTrackSegment())
+                    new_segments[-1].points = piece
+            track.segments = new_segments
+
     def untangle(self, force=False):
         """Locate stops and clean away its local erratic movements.
 
         Returns:A list of strings describing what happens/would happen
 
         """
-        self.__prepare_point_data()
-        self.all_points = self.point_list()  # pylint:disable=attribute-defined-outside-init
+        if len(self.point_list()) < 2:
+            return list()
+        self.__point_data = data = _PointData(self)
         try:
             return self.__remove_single_points(force)
         finally:
             if force:
                 self.add_segment_waypoints(at_end=True)
-            for _ in self.all_points:
-                if logging.getLogger().level == logging.DEBUG:
+            if logging.getLogger().level == logging.DEBUG:
+                for idx, _ in enumerate(data.points):
                     _.name = '{} turn={} speed_after={} weight={}'.format(
-                        _.name or '', _.turn, _.speed_after, _.weight)
-                delattr(_, 'turn')
-                delattr(_, 'way_before')
-                delattr(_, 'way_after')
-                delattr(_, 'time_before')
-                delattr(_, 'time_after')
-                delattr(_, 'speed_before')
-                delattr(_, 'speed_after')
-                delattr(_, 'weight')
-            delattr(self, 'all_points')
+                        _.name or '', data.turn[idx], data.speed_after[idx], data.weight[idx])
+            self.__point_data = None
 
     def clear_segments(self):
         """For each track, combine all segments into one."""
@@ -1073,22 +1589,30 @@ class Gpx(GPX):
             track.segments = track.segments[:1]
 
     def simplify(self, max_distance=None):
-        """Just like gpxpy does. But if we get a strin gending with 'p', reduce to that point number."""
+        """Just like gpxpy does. But if we get a string ending with 'p', reduce to that point number.
+
+        The points with the least significance for the Ramer-Douglas-Peucker algorithm are removed.
+        Points with equal significance are kept in the order the algorithm splits the lines,
+        so a point is never kept without the point which split its line.
+
+        """
         try:
             max_distance = float(max_distance)
             super(Gpx, self).simplify(max_distance)
         except ValueError:
+            wanted = max(int(max_distance[:-1]), 2)
             for trk_idx, track in enumerate(self.tracks):
                 for seg_idx, segment in enumerate(track.segments):
                     points = segment.points
-                    _ = 0.5
-                    while len(points) > int(max_distance[:-1]):
-                        _ *= 1.1
-                        points = simplify_polyline(segment.points[:], max_distance=_)
-                    if _ > 0.5:
-                        logging.info('Trk/Seg %s/%s: maximal deviation is %.02f meters, reduced from %s to %s points',
-                                     trk_idx, seg_idx, _, len(segment.points), len(points))
-                    segment.points = points
+                    if len(points) <= wanted:
+                        continue
+                    significance, order = _significance(points)
+                    keep = numpy.sort(numpy.lexsort((order, -significance))[:wanted])
+                    dropped = numpy.ones(len(points), dtype=bool)
+                    dropped[keep] = False
+                    logging.info('Trk/Seg %s/%s: maximal deviation is %.02f meters, reduced from %s to %s points',
+                                 trk_idx, seg_idx, significance[dropped].max(), len(points), len(keep))
+                    segment.points = [points[x] for x in keep]
 
     def revert_direction(self):
         """Revert the direction of the track. Reverts track/segment order and points within."""
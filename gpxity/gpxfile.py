@@ -13,12 +13,13 @@ from functools import total_ordering
 from contextlib import contextmanager
 import weakref
 from copy import deepcopy
+from itertools import compress
 import logging
+from typing import Optional
 
 # pylint: disable=too-many-lines
 
 from gpxpy import gpx as mod_gpx
-from gpxpy.geo import simplify_polyline
 
 from .gpx import Gpx
 from .backend_base import BackendBase
@@ -126,6 +127,9 @@ class GpxFile:  # pylint: disable=too-many-public-methods
         self.__backend = None
         self.__cached_time = None
         self.__cached_distance = None
+        self.__header_last_time = None
+        self.__header_point_count = None
+        self.__header_ends = None
         # those are read from the backend but writing them to the same
         # backend would fence them away. We want to avoid simple
         # in-place operations removing positions.
@@ -140,6 +144,7 @@ class GpxFile:  # pylint: disable=too-many-public-methods
         self._similarity_others = weakref.WeakValueDictionary()  # other Gpxfiles pointing back to us
         self._similarities = dict()
         self.__without_fences = None  # used by context manager "fenced()"
+        self.__appending = False  # add_points tells __decode_gpx
         self.gpx = gpx
 
     def __decode_gpx(self):
@@ -159,11 +164,14 @@ class GpxFile:  # pylint: disable=too-many-public-methods
         If an attribute is changed, the full gpxfile is always loaded first.
 
         """
-        self.__gpx.decode()
+        self.__gpx.decode(appended=self.__appending)
 
         # lazy attributes:
         self.__cached_distance = None
         self.__cached_time = None
+        self.__header_last_time = None
+        self.__header_point_count = None
+        self.__header_ends = None
         self._clear_similarity_cache()
 
     def __encode_gpx(self):
@@ -226,7 +234,10 @@ class GpxFile:  # pylint: disable=too-many-public-methods
             self.__ids.insert(0, str(self))
         if self.__is_decoupled:
             # internal use
+            old_value = self.__id_in_backend
             self.__id_in_backend = value
+            if self.__backend:
+                self.__backend._ident_changed(self, old_value)
         else:
             if not self.__id_in_backend:
                 raise ValueError('Cannot set id_in_backend for yet unsaved gpxfile {}'.format(self))
@@ -457,7 +468,8 @@ class GpxFile:  # pylint: disable=too-many-public-methods
         """Suppress points in fences.
 
         While this context manager is running, suppressed points are
-        not visible.
+        not visible. Only segments which actually lose points are
+        replaced by filtered copies, see :meth:`Gpx.fence_masks <gpxity.gpx.Gpx.fence_masks>`.
 
         """
         if fences is None:
@@ -469,26 +481,37 @@ class GpxFile:  # pylint: disable=too-many-public-methods
         if self.__without_fences is not None:
             raise Exception('fenced() is already active')
         without_fences = dict()
+        all_waypoints = self.__gpx.waypoints
+        old_illegals = self._illegal_points
+        changed = False
         try:
-            old_points = self.__gpx.get_track_points_no()
-            old_illegals = self._illegal_points
             self._illegal_points = 0
-            for track_idx, track in enumerate(self.__gpx.tracks):
-                for seg_idx, segment in enumerate(track.segments):
-                    without_fences[(track_idx, seg_idx)] = segment.points
-                    segment.points = [x for x in segment.points if fences.outside(x)]
-            all_waypoints = self.__gpx.waypoints
-            self.__gpx.waypoints = [x for x in self.__gpx.waypoints if fences.outside(x)]
-            self._clear_similarity_cache()
-            new_points = self.__gpx.get_track_points_no()
-            if new_points < old_points:
-                logging.info('%s: Fencing removed %s points', self, old_points - new_points)
+            masks = self.__gpx.fence_masks(fences)
+            removed = sum(len(x) - int(x.sum()) for x in masks)
+            if removed:
+                segments = (
+                    (track_idx, seg_idx, segment)
+                    for track_idx, track in enumerate(self.__gpx.tracks)
+                    for seg_idx, segment in enumerate(track.segments))
+                for (track_idx, seg_idx, segment), mask in zip(segments, masks):
+                    if not mask.all():
+                        without_fences[(track_idx, seg_idx)] = segment.points
+                        segment.points = list(compress(segment.points, mask))
+            waypoint_mask = fences.mask(all_waypoints)
+            if not waypoint_mask.all():
+                self.__gpx.waypoints = list(compress(all_waypoints, waypoint_mask))
+            changed = bool(without_fences) or self.__gpx.waypoints is not all_waypoints
+            if changed:
+                self._clear_similarity_cache()
+            if removed:
+                logging.info('%s: Fencing removed %s points', self, removed)
             yield
         finally:
             for (track_idx, seg_idx), points in without_fences.items():
                 self.__gpx.tracks[track_idx].segments[seg_idx].points = points
-            self.__gpx.waypoints = all_waypoints
-            self._clear_similarity_cache()
+            if changed:
+                self.__gpx.waypoints = all_waypoints
+                self._clear_similarity_cache()
             self.__without_fences = None
             self._illegal_points = old_illegals
 
@@ -604,10 +627,19 @@ class GpxFile:  # pylint: disable=too-many-public-methods
         Returns: True for success
 
         """
-        if (self.backend and self.id_in_backend and not self.__gpx.is_complete
-                and not self.__is_decoupled and 'scan' in self.backend.supported):  # noqa
+        if self._needs_load_full():
             self.backend._read_all_decoupled(self)
 
+    def _needs_load_full(self) ->bool:
+        """Check if :meth:`_load_full` would read from the backend.
+
+        Returns: True or False
+
+        """
+        return bool(
+            self.backend and self.id_in_backend and not self.__gpx.is_complete
+            and not self.__is_decoupled and 'scan' in self.backend.supported)
+
     def add_points(self, points) ->None:
         """Round and add points to last segment in the last gpxfile.
 
@@ -621,7 +653,11 @@ class GpxFile:  # pylint: disable=too-many-public-methods
         if points:
             self._round_points(points)
             self.gpx.add_points(points)
-            self._dirty = 'gpx'
+            self.__appending = True
+            try:
+                self._dirty = 'gpx'
+            finally:
+                self.__appending = False
 
     def __decode_category(self, value) -> str:
         """Helper for _decode_keywords.
@@ -722,12 +758,68 @@ class GpxFile:  # pylint: disable=too-many-public-methods
     def last_time(self) ->datetime.datetime:
         """The last time we received in UTC.
 
+        This property can only be set while the full gpxfile has not yet
+        been loaded. The setter is used by the backends when scanning for all gpxfiles.
+
         Returns:
             The last time we received so far. If none, return None.
 
         """
+        if self.__header_last_time is not None and not self.__gpx.is_complete:
+            return self.__header_last_time
         return self.gpx.last_time
 
+    @last_time.setter
+    def last_time(self, value):
+        """The setter."""
+        if self.__gpx.is_complete:
+            raise Exception('Setting GpxFile.last_time is only allowed while the full gpxfile has not yet been loaded')
+        self.__header_last_time = value
+
+    @property
+    def point_count(self) ->int:
+        """The number of track points.
+
+        This property can only be set while the full gpxfile has not yet
+        been loaded. The setter is used by the backends when scanning for all gpxfiles.
+
+        Returns:
+            The number of track points
+
+        """
+        if self.__header_point_count is not None and not self.__gpx.is_complete:
+            return self.__header_point_count
+        return self.gpx.get_track_points_no()
+
+    @point_count.setter
+    def point_count(self, value):
+        """The setter."""
+        if self.__gpx.is_complete:
+            raise Exception('Setting GpxFile.point_count is only allowed while the full gpxfile has not yet been loaded')
+        self.__header_point_count = value
+
+    def _set_header_ends(self, first_point, last_point):
+        """The backend knows the first and the last point without loading the full gpxfile.
+
+        They are used by :meth:`angle`.
+
+        """
+        if self.__gpx.is_complete:
+            raise Exception('Setting the header ends is only allowed while the full gpxfile has not yet been loaded')
+        self.__header_ends = (first_point, last_point)
+
+    def _time_span(self):
+        """The time span, without loading the full gpxfile if the backend already listed it.
+
+        Returns:
+            (first_time, last_time) or None if there is no time at all
+
+        """
+        first_time = self.first_time
+        if first_time is None:
+            return None
+        return first_time, self.last_time or first_time
+
     @property
     def keywords(self):
         """list(str): represent them as a sorted list - in GPX they are comma separated.
@@ -1024,6 +1116,9 @@ class GpxFile:  # pylint: disable=too-many-public-methods
             If we have no two points, return 0
 
         """
+        if first_point is None and last_point is None and self.__header_ends is not None:
+            if not self.__gpx.is_complete:
+                return self.__gpx.angle(*self.__header_ends, precision=precision)
         return self.gpx.angle(first_point=first_point, last_point=last_point, precision=precision)
 
     def segments(self):
@@ -1051,11 +1146,24 @@ class GpxFile:  # pylint: disable=too-many-public-methods
     def point_list(self):
         """A flat list with all points.
 
+        See :meth:`Gpx.point_list() <gpxity.gpx.Gpx.point_list>`.
+
+        Returns:
+            The list
+
+        """
+        return self.gpx.point_list()
+
+    def _point_list(self):
+        """The cached list behind :meth:`point_list`, without copying it.
+
+        See :meth:`Gpx._point_list() <gpxity.gpx.Gpx._point_list>`.
+
         Returns:
             The list
 
         """
-        return sum((x.points for x in self.segments()), [])
+        return self.gpx._point_list()
 
     def last_point(self):
         """Return the last point of the track. None if none."""
@@ -1114,26 +1222,32 @@ class GpxFile:  # pylint: disable=too-many-public-methods
     def overlapping_times(gpxfiles):
         """Find gpxfiles with overlapping times.
 
+        The time spans come from the headers if the backend listed them,
+        so most backends do not need to load the gpxfiles.
+        Gpxfiles without time are ignored.
+
         Yields:
             groups of gpxfiles with overlapping times. Sorted by time.
 
-        This may be very slow for many long gpxfiles.
-
         """
-        previous = None
+        spans = list()
+        for gpxfile in gpxfiles:
+            span = gpxfile._time_span()  # pylint: disable=protected-access
+            if span is not None:
+                spans.append((span, gpxfile))
+        spans.sort(key=lambda x: x[0][0])
         group = list()  # GpxFile is  mutable, so a set is no possible
-        for current in sorted(gpxfiles, key=lambda x: x.first_time):
-            if previous and current.first_time <= previous.last_time:
-                if previous not in group:
-                    group.append(previous)
-                group.append(current)
-            else:
-                if group:
-                    yield sorted(group, key=lambda x: x.first_time)
-                    group = list()
-            previous = current
-        if group:
-            yield sorted(group, key=lambda x: x.first_time)
+        group_end = None
+        for (first_time, last_time), current in spans:
+            if group and first_time > group_end:
+                if len(group) > 1:
+                    yield group
+                group = list()
+            if not group or last_time > group_end:
+                group_end = last_time
+            group.append(current)
+        if len(group) > 1:
+            yield group
 
     def _has_default_title(self) ->bool:
         """Try to check if gpxfile has the default title given by a backend.
@@ -1358,28 +1472,26 @@ class GpxFile:  # pylint: disable=too-many-public-methods
 
     def __similarity_to(self, other):
         """Return a float 0..1: 1 is identity."""
-
-        def simple(gpxfile):
-            """Simplified gpxfile"""
-            return [(round(x.latitude, 3), round(x.longitude, 3))
-                    for x in simplify_polyline(list(gpxfile.points()), max_distance=50)]
-
         if id(other) not in self._similarity_others:
-            simple1 = simple(self)
-            simple2 = simple(other)
-            max_len = max([len(simple1), len(simple2)])
-            similar_length = 1.0 - abs(len(simple1) - len(simple2)) / max_len
-            set1 = set(simple1)
-            set2 = set(simple2)
-            min_len = min([len(set1), len(set2)])
-            similar_points = len(set1 & set2) / min_len
-            result = similar_length * similar_points
+            result = Gpx.fingerprint_similarity(self._fingerprint(), other._fingerprint())
             self._similarity_others[id(other)] = other
             self._similarities[id(other)] = result
             other._similarity_others[id(self)] = self
             other._similarities[id(self)] = result
         return self._similarities[id(other)]
 
+    def _fingerprint(self):
+        """The fingerprint, see :meth:`Gpx.fingerprint <gpxity.gpx.Gpx.fingerprint>`.
+
+        The backend may know it without loading the gpxfile.
+
+        Returns: The fingerprint
+
+        """
+        if self.backend is not None:
+            return self.backend._fingerprint(self)
+        return self.gpx.fingerprint()
+
     def similarity(self, others):
         """Return a float 0..1: 1 is identity.
 
@@ -1538,7 +1650,7 @@ class GpxFile:  # pylint: disable=too-many-public-methods
         if changed:
             self.rewrite()
 
-    def locate_point(self, track=0, segment=0, point=0) ->str:
+    def locate_point(self, track=0, segment=0, point=0) ->Optional[str]:
         """Determine name of place for point.
 
         Saves that in point.name for caching. If backend.account.country is given,
@@ -1548,7 +1660,7 @@ class GpxFile:  # pylint: disable=too-many-public-methods
         Args:
             track, segment, point: Indices into the respective arrays
 
-        Returns: A string
+        Returns: A string, None if the lookup failed
 
         """
         try:
@@ -1563,15 +1675,17 @@ class GpxFile:  # pylint: disable=too-many-public-methods
     def add_locations(self, segments=False):
         """Call locate_point for the first point.
 
+        All points are located in parallel and the gpxfile is rewritten only once.
+
         Args: segments: Also do that for the first point of each segment.
 
         """
+        points = [x.points[0] for x in self.gpx.segments() if x.points]
+        if not segments:
+            points = points[:1]
         with self.batch_changes():
-            self.locate_point()
-            if segments:
-                for track_idx, gpx_track in enumerate(self.gpx.tracks):
-                    for seg_idx, _ in enumerate(gpx_track.segments):
-                        self.locate_point(track=track_idx, segment=seg_idx)
+            if self.gpx.locate_points(points) and self.backend:
+                self.rewrite()
 
     def add_segment_waypoints(self):
         """Every segment start gets a waypoint.
@@ -10,6 +10,9 @@
 
 import datetime
 import logging
+import queue
+import threading
+from itertools import compress
 
 from .gpxfile import GpxFile
 from .backend_base import BackendBase
@@ -19,12 +22,37 @@ __all__ = ['Lifetrack']
 
 class LifetrackTarget:
 
-    """A single target of a lifetracking instance."""
+    """A single target of a lifetracking instance.
+
+    Secondary targets of an asynchronous :class:`Lifetrack` get their points through
+    a queue, a worker thread delivers them. If the backend is slower than the
+    point source, all waiting points are coalesced into one update. The worker
+    is a daemon thread: points still queued when the process exits are lost, so
+    :meth:`Lifetrack.end` must be called.
+
+    Attributes:
+        pending: The number of queued points not yet delivered
+        max_pending: The maximum of pending so far
+        coalesced: How many queued updates were merged into a previous one
+        deliveries: The number of updates given to the backend
+
+    """
+
+    # seconds until an idle worker thread ends
+    idle_timeout = 60
 
     def __init__(self, lifetrack, backend, use_id=None):
         """See class docstring."""
         self.lifetrack = lifetrack
         self.backend = backend
+        self.pending = 0
+        self.max_pending = 0
+        self.coalesced = 0
+        self.deliveries = 0
+        self.__queue = queue.Queue()
+        self.__worker = None
+        self.__error = None
+        self.__lock = threading.Lock()
         if use_id in backend:
             existing_track = backend[use_id]
             self.gpxfile = existing_track.clone()
@@ -74,10 +102,84 @@ class LifetrackTarget:
             self.gpxfile, self.gpxfile.backend)
         return new_ident
 
+    def deliver(self, points) ->None:
+        """Queue points for the worker thread, which is started when needed."""
+        with self.__lock:
+            self.pending += len(points)
+            self.max_pending = max(self.max_pending, self.pending)
+            self.__queue.put(list(points))
+            if self.__worker is None:
+                self.__worker = threading.Thread(
+                    target=self.__work, name='lifetrack {}'.format(self.backend.account), daemon=True)
+                self.__worker.start()
+
+    def __next_points(self):
+        """Get all queued points for the worker thread.
+
+        Returns: (points, stop). points is None if the worker should end.
+
+        """
+        try:
+            points = self.__queue.get(timeout=self.idle_timeout)
+        except queue.Empty:
+            with self.__lock:
+                if self.__queue.empty():
+                    # idle, do not keep a thread for a Lifetrack that is never ended
+                    self.__worker = None
+                    return None, True
+            points = self.__queue.get()
+        if points is None:
+            return None, True
+        while True:
+            try:
+                more = self.__queue.get_nowait()
+            except queue.Empty:
+                return points, False
+            if more is None:
+                return points, True
+            points.extend(more)
+            self.coalesced += 1
+
+    def __work(self):
+        """The worker thread: deliver queued points."""
+        stop = False
+        while not stop:
+            points, stop = self.__next_points()
+            if points is None:
+                break
+            with self.__lock:
+                self.pending -= len(points)
+            try:
+                self.update_tracker(points)
+                self.deliveries += 1
+            except Exception as exc:  # pylint: disable=broad-except
+                logging.error('Lifetrack %s: %s failed: %s', self.tracker_id, self.backend.account, exc)
+                if self.__error is None:
+                    self.__error = exc
+
+    def flush(self) ->None:
+        """Wait until the worker thread delivered all queued points.
+
+        Re-raises the first exception the worker got.
+
+        """
+        with self.__lock:
+            worker = self.__worker
+            if worker is not None:
+                self.__queue.put(None)
+                self.__worker = None
+        if worker is not None:
+            worker.join()
+        if self.__error is not None:
+            error = self.__error
+            self.__error = None
+            raise error
+
     def end(self):
         """End lifetracking for a specific backend.
         Because of fencing, lifetracking may not even have started."""
-        if self.gpxfile.point_list() or self.backend.accepts_zero_points:
+        self.flush()
+        if self.gpxfile._point_list() or self.backend.accepts_zero_points:
             self.backend._lifetrack_end(self.gpxfile)
 
     @staticmethod
@@ -96,13 +198,13 @@ class LifetrackTarget:
             The prepared points
 
         """
-        result = [x for x in points if self.backend.account.fences.outside(x)]
+        result = list(compress(points, self.backend.account.fences.mask(points)))
         if len(result) < len(points):
             self.backend.logger.debug(
                 "Target %s Fences removed %d out of %d points",
                 self.backend.account, len(points) - len(result), len(points))
         self.gpxfile._round_points(result)
-        have = {self.__point_tuple(x) for x in self.gpxfile.point_list()[-len(points) * 2:]}  # noqa
+        have = {self.__point_tuple(x) for x in self.gpxfile._point_list()[-len(points) * 2:]}  # noqa
         result2 = [x for x in result if self.__point_tuple(x) not in have]
         if len(result) > len(result2):
             logging.info('Target %s ignored %s resent points', self.backend.account, len(result) - len(result2))
@@ -125,16 +227,22 @@ class Lifetrack:
         sender_ip: The IP of the client.
         target_backends (list): Those gpxfiles will receive the lifetracking data.
         tracker _id: The id for this Lifetrack instance.
+        asynchronous: The first backend is always updated directly. If True, the others
+            are updated by worker threads, so a slow backend does not delay the others.
+            Errors from those backends are then only logged when they happen, the first one
+            is raised by :meth:`end`. :meth:`end` must be called, otherwise queued points
+            may never be delivered. Default is False.
 
     Attributes:
         done: Will be True after end() has been called.
 
     """
 
-    def __init__(self, sender_ip, target_backends, tracker_id: str = None):
+    def __init__(self, sender_ip, target_backends, tracker_id: str = None, asynchronous: bool = False):
         """See class docstring."""
         assert sender_ip is not None
         self.done = False
+        self.asynchronous = asynchronous
         self.sender_ip = sender_ip
         main_target = LifetrackTarget(self, target_backends[0], tracker_id)
         self.targets = [main_target]
@@ -193,11 +301,20 @@ class Lifetrack:
             points(list): New points
 
         """
-        for _ in self.targets:
-            _.update_tracker(points)
+        self.targets[0].update_tracker(points)
+        for _ in self.targets[1:]:
+            if self.asynchronous:
+                _.deliver(points)
+            else:
+                _.update_tracker(points)
+        self.__link_secondaries()
 
-        # All secondary targets must be linked to the primary one.
-        # Only the primary target is granted to exist when tracking starts.
+    def __link_secondaries(self):
+        """All secondary targets must be linked to the primary one.
+
+        Only the primary target is granted to exist when tracking starts.
+
+        """
         main_target = self.targets[0]
         main = main_target.backend[main_target.gpxfile.id_in_backend]
         with main.batch_changes():
@@ -212,10 +329,32 @@ class Lifetrack:
     def end(self):
         """End lifetrack.
 
+        If asynchronous, this waits until all queued points are delivered and raises the
+        first error a secondary backend had. That error is only raised after all targets
+        have been ended.
+
         If the backend does not support lifetrack, this does nothing."""
-        for _ in self.targets:
-            _.end()
+        error = None
+        steps = [x.flush for x in self.targets[1:]]
+        steps.append(self.__link_secondaries)
+        steps.extend(x.end for x in self.targets)
+        for step in steps:
+            try:
+                step()
+            except Exception as exc:  # pylint: disable=broad-except
+                if error is None:
+                    error = exc
         self.done = True
+        if error is not None:
+            raise error
+
+    def pending(self) ->int:
+        """The number of points waiting for delivery to secondary targets.
+
+        Returns: int
+
+        """
+        return sum(x.pending for x in self.targets)
 
     def __str__(self):  # noqa
         return 'Lifetrack({} plus {}{})'.format(
@@ -8,9 +8,10 @@
 
 import logging
 
-import geocoder
 from gpxpy.gpx import GPXTrackPoint
 
+from .geocache import GeoCache
+
 __all__ = ['Locate']
 
 
@@ -23,8 +24,8 @@ class Locate:
         gpxfiles: The gpxfiles to be searched
 
     Attributes:
-        locations: The list of found places. For each given value in arg **places**,
-            locations holds one result, even if the provider returns more than one.
+        locations: The list of found places, see :class:`~gpxity.geocache.Place`. For each given
+            value in arg **places**, locations holds one result, even if the provider returns more than one.
         distances: A list with a tuple for every gpxfile. The tuple holds the gpxfile
             and a list of distances between that gpxfile and places.
 
@@ -38,10 +39,10 @@ class Locate:
         self.gpxfiles = gpxfiles
         self.locations = list()
         for place in places:
-            _ = geocoder.get(place, provider='osm')
+            _ = GeoCache.shared().forward(place)
             if not _:
                 raise Exception('Place not found: {}'.format(place))
-            self.locations.append(_[0])
+            self.locations.append(_)
         logging.info('using locations:')
         for _ in self.locations:
             logging.info('  %s', _.address)
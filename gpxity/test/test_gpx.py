@@ -13,13 +13,27 @@ They only use backend Directory, so there is no network traffic involved
 
 # pylint: disable=protected-access
 
+import datetime
+import io
 import logging
+import os
+import random
+import tempfile
+import time
 import unittest
 
 from gpxpy import gpx as mod_gpx
+from gpxpy import parse as gpxpy_parse
+from gpxpy.geo import length as gpx_length
+from gpxpy.geo import simplify_polyline, get_line_equation_coefficients
 
 
 from .. import Gpx
+from ..gpx import _stream_parse, _Unsupported, _significance, _PointData
+from ..columns import BoundsIndex
+from ..geocache import GeoCache
+from ..accounts import Fences
+from ..util import add_speed
 
 # pylint: disable=attribute-defined-outside-init
 
@@ -123,3 +137,371 @@ class GpxTests(unittest.TestCase):
         gpx2 = Gpx.parse(self.xml)
         self.assertEqual(gpx1.tracks[0].name, gpx2.tracks[1].name)
         self.assertEqual(gpx1.tracks[0].type, gpx2.tracks[1].type)
+
+    def test_point_columns(self):
+        """Test the columnar metrics against gpxpy."""
+        gpx1 = Gpx.parse(self.xml)
+        points = list(gpx1.point_list())
+        self.assertAlmostEqual(gpx1.point_columns().length(), gpx_length(points), places=6)
+        self.assertEqual(gpx1.distance, round(gpx_length(points) / 1000, 3))
+        self.assertIs(gpx1.point_columns(), gpx1.point_columns())
+        gpx1.tracks[1].segments[0].points.append(GPXTrackPoint(53.6, 13.4))
+        self.assertEqual(gpx1.point_columns().size, 3)
+        self.assertAlmostEqual(gpx1.point_columns().length(), gpx_length(gpx1.point_list()), places=6)
+        gpx2 = Gpx()
+        gpx2.add_points(gpx1.point_list()[1:])
+        self.assertEqual(gpx1.index(gpx2), 1)
+        self.assertIsNone(gpx2.index(gpx1))
+        self.assertTrue(gpx1.points_equal(gpx1.clone()))
+        self.assertEqual(gpx1.points_hash(), gpx1.clone().points_hash())
+
+    def test_stream_parse(self):
+        """Test that the streaming parser and gpxpy agree."""
+        expected = gpxpy_parse(self.xml).to_xml()
+        self.assertEqual(_stream_parse(self.xml).to_xml(), expected)
+        self.assertEqual(_stream_parse(io.BytesIO(self.xml.encode('utf-8'))).to_xml(), expected)
+        self.assertEqual(Gpx.parse(io.BytesIO(self.xml.encode('utf-8'))).xml(), Gpx.parse(self.xml).xml())
+        self.assertEqual(Gpx.parse(io.BytesIO()).get_track_points_no(), 0)
+        for point in Gpx.parse(self.xml).points():
+            self.assertIsNotNone(point.time.tzinfo)
+        with_extension = self.xml.replace(
+            '<ele>42.50</ele>', '<ele>42.50</ele><extensions><gpxtpx:TrackPointExtension/></extensions>')
+        with self.assertRaises(_Unsupported):
+            _stream_parse(with_extension)
+        gpx1 = Gpx.parse(with_extension)
+        self.assertEqual(len(gpx1.tracks[0].segments[0].points[0].extensions), 1)
+
+    def test_bounds_index(self):
+        """BoundsIndex must never reject what PointColumns accepts."""
+        random.seed(1)
+        base = [(random.uniform(-80, 80), random.uniform(-170, 170)) for _ in range(3)]
+        columns = list()
+        for _ in range(40):
+            lat, lon = random.choice(base)
+            start = random.choice([0, 3, 6])
+            gpx = Gpx()
+            count = random.choice([0, 5, 10])
+            gpx.add_points([GPXTrackPoint(lat + idx * 1e-4, lon + idx * 2e-4) for idx in range(start, start + count)])
+            columns.append(gpx.point_columns())
+        bounds = BoundsIndex(columns)
+        for idx, root in enumerate(columns):
+            within = bounds.within(idx)
+            containing = bounds.containing(idx)
+            equal = bounds.equal(idx)
+            for other_idx, other in enumerate(columns):
+                if root.index(other) is not None:
+                    self.assertTrue(within[other_idx])
+                if other.index(root) is not None:
+                    self.assertTrue(containing[other_idx])
+                if root.positions_equal(other):
+                    self.assertTrue(equal[other_idx])
+        self.assertLess(bounds.within(0).sum(), len(columns))
+
+    def test_index(self):
+        """Gpx.index must find the first matching start, also with long pauses."""
+        def gpx_from(points):
+            result = Gpx()
+            result.add_points([GPXTrackPoint(*x) for x in points])
+            return result
+
+        moving = [(50 + idx * 0.001, 8 + idx * 0.002) for idx in range(100)]
+        pause = [(50.0, 8.0)] * 100
+        gpx1 = gpx_from(pause + moving)
+        self.assertEqual(gpx1.index(gpx_from(pause[:30] + moving[:10])), 70)
+        self.assertEqual(gpx1.index(gpx_from(pause[:30])), 0)
+        self.assertEqual(gpx1.index(gpx_from(moving[50:])), 150)
+        self.assertIsNone(gpx1.index(gpx_from(pause[:30] + moving[5:10])))
+        self.assertIsNone(gpx1.index(gpx_from(moving + [(1, 1)])))
+        self.assertEqual(gpx1.index(Gpx()), 0)
+
+    def test_point_list(self):
+        """The cached point_list and point_location."""
+        gpx = Gpx.parse(self.xml)
+        gpx.tracks[1].segments.append(mod_gpx.GPXTrackSegment())
+        gpx.tracks[1].segments[1].points.extend(GPXTrackPoint(54, 13 + x / 100) for x in range(5))
+        points = gpx.point_list()
+        cached = gpx._point_list()
+        self.assertIsNot(gpx.point_list(), points)
+        self.assertEqual(points, list(gpx.points()))
+        points.clear()
+        self.assertIs(gpx._point_list(), cached)
+        self.assertEqual(cached, list(gpx.points()))
+        points = gpx.point_list()
+        self.assertEqual(points, list(gpx.points()))
+        for idx, point in enumerate(points):
+            track_idx, segment_idx, point_idx = gpx.point_location(idx)
+            self.assertIs(gpx.tracks[track_idx].segments[segment_idx].points[point_idx], point)
+        self.assertEqual(gpx.point_location(-1), gpx.point_location(len(points) - 1))
+        with self.assertRaises(IndexError):
+            gpx.point_location(len(points))
+        gpx.tracks[0].segments.insert(1, mod_gpx.GPXTrackSegment())
+        gpx.tracks[-1].segments[-1].points.append(GPXTrackPoint(50, 8))
+        self.assertIsNot(gpx._point_list(), cached)
+        self.assertEqual(len(gpx.point_list()), len(points) + 1)
+        self.assertEqual(gpx.point_location(len(points)), (len(gpx.tracks) - 1, len(gpx.tracks[-1].segments) - 1,
+                                                           len(gpx.tracks[-1].segments[-1].points) - 1))
+        cached = gpx._point_list()
+        gpx.decode()
+        self.assertIsNot(gpx._point_list(), cached)
+
+    def test_add_points_running(self):
+        """add_points updates distance, speed and point_list incrementally."""
+        gpx = Gpx.parse(self.xml)
+        self.assertEqual(gpx.distance, round(gpx_length(list(gpx.point_list())) / 1000, 3))
+        cached = gpx._point_list()
+        start = gpx.last_time
+        for idx in range(1, 20):
+            gpx.add_points([GPXTrackPoint(
+                53.5 + idx / 1000, 13.38, time=start + datetime.timedelta(seconds=idx * 10))])
+            gpx.decode(appended=True)
+        self.assertIs(gpx._point_list(), cached)
+        points = gpx.point_list()
+        self.assertEqual(points, list(gpx.points()))
+        expected = round(gpx_length(points) / 1000, 3)
+        self.assertEqual(gpx.distance, expected)
+        speed = gpx.speed()
+        gpx.decode()
+        self.assertEqual(gpx.distance, expected)
+        self.assertEqual(gpx.speed(), speed)
+        gpx.last_point().latitude += 1
+        gpx.decode()
+        self.assertNotEqual(gpx.distance, expected)
+
+    def test_add_speed_appending(self):
+        """Appending points and add_speed on the cached point list only visit the new points."""
+        visited = set()
+
+        class CountingPoint(GPXTrackPoint):
+
+            """Remembers which points were looked at."""
+
+            def __getattribute__(self, name):
+                visited.add(id(self))
+                return super().__getattribute__(name)
+
+        start = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+        gpx = Gpx()
+        gpx.add_points([
+            CountingPoint(50 + idx / 10000, 8, time=start + datetime.timedelta(seconds=idx))
+            for idx in range(5000)])
+        add_speed(gpx._point_list(), window=10)
+        for idx in range(5000, 5100, 5):
+            new_points = [
+                CountingPoint(50 + x / 10000, 8, time=start + datetime.timedelta(seconds=x))
+                for x in range(idx, idx + 5)]
+            visited.clear()
+            gpx.add_points(new_points)
+            gpx.decode(appended=True)
+            add_speed(gpx._point_list(), window=10)
+            self.assertLessEqual(len(visited), 5 + 10 + 1)
+            self.assertTrue(all(hasattr(x, 'gpxity_speed') for x in new_points))
+
+    def test_untangle(self):
+        """untangle removes a single point between long pauses."""
+        start = datetime.datetime(2019, 6, 1, tzinfo=datetime.timezone.utc)
+        points = [
+            GPXTrackPoint(50 + idx * 0.0003, 8, time=start + datetime.timedelta(seconds=idx * 3), name=str(idx))
+            for idx in range(30)]
+        single = points[20]
+        single.latitude, single.longitude = points[19].latitude, 8.0003
+        for point in points[20:]:
+            point.time += datetime.timedelta(seconds=900)
+        for point in points[21:]:
+            point.time += datetime.timedelta(seconds=900)
+            point.latitude -= 0.0003
+        gpx = Gpx()
+        gpx.add_points(points)
+        self.assertEqual(len(gpx.untangle()), 1)
+        self.assertEqual(gpx.get_track_points_no(), 30)
+        messages = gpx.untangle(force=True)
+        self.assertEqual(len(messages), 1)
+        self.assertIn('0:15:03/0:15:03', messages[0])
+        self.assertEqual([len(x.points) for x in gpx.tracks[0].segments], [20, 9])
+        self.assertNotIn(single, gpx.point_list())
+        self.assertFalse(hasattr(points[0], 'turn'))
+        self.assertEqual(len(gpx.waypoints), 4)
+
+    def test_untangle_speed(self):
+        """The speeds for untangle are computed like gpxpy distance_2d does."""
+        rnd = random.Random(0)
+        start = datetime.datetime(2019, 6, 1, tzinfo=datetime.timezone.utc)
+        for _ in range(20):
+            latitude, longitude = rnd.uniform(-60, 60), rnd.uniform(-170, 170)
+            points = list()
+            for idx in range(100):
+                points.append(GPXTrackPoint(
+                    round(latitude, 6), round(longitude, 6), time=start + datetime.timedelta(seconds=idx * 3)))
+                latitude += rnd.uniform(-3e-4, 3e-4)
+                longitude += rnd.uniform(-3e-4, 3e-4)
+            gpx = Gpx()
+            gpx.add_points(points)
+            self.assertEqual(
+                list(_PointData(gpx).speed_after[:-1]),
+                [round(x.distance_2d(y) / 3 * 3.6, 2) for x, y in zip(points, points[1:])])
+
+    def test_simplify_points(self):
+        """simplify('NNNp') keeps the most significant points."""
+        random.seed(2)
+        points = list()
+        for idx in range(300):
+            points.append(GPXTrackPoint(50 + idx * 1e-4 + random.uniform(0, 2e-4), 8 + random.uniform(0, 1e-3)))
+        significance, _ = _significance(points)
+        for max_distance in (1, 10, 50):
+            self.assertEqual(
+                simplify_polyline(points, max_distance),
+                [x for idx, x in enumerate(points) if significance[idx] >= max_distance])
+        gpx = Gpx()
+        gpx.add_points(points)
+        gpx.simplify('40p')
+        self.assertEqual(gpx.get_track_points_no(), 40)
+        self.assertIs(gpx.point_list()[0], points[0])
+        self.assertIs(gpx.point_list()[-1], points[-1])
+        gpx.simplify('100p')
+        self.assertEqual(gpx.get_track_points_no(), 40)
+
+    def test_simplify_split_order(self):
+        """simplify('NNNp') gives the result of simplify_polyline and keeps the split order for ties."""
+        random.seed(3)
+        points = [GPXTrackPoint(50 + random.uniform(0, 1e-2), 8 + random.uniform(0, 1e-2)) for _ in range(200)]
+        significance, _ = _significance(points)
+        for max_distance in sorted(set(significance))[:-1:5]:
+            expected = simplify_polyline(points, max_distance)
+            gpx = Gpx()
+            gpx.add_points(points)
+            gpx.simplify('{}p'.format(len(expected)))
+            self.assertEqual(gpx.point_list(), expected)
+        kept = [0, len(points) - 1]
+        for wanted in range(3, 80):
+            gpx = Gpx()
+            gpx.add_points(points)
+            gpx.simplify('{}p'.format(wanted))
+            indices = [points.index(x) for x in gpx.point_list()]
+            added = (set(indices) - set(kept)).pop()
+            self.assertEqual(sorted(kept + [added]), indices)
+            # the added point must be the one which splits the line between its neighbours
+            first = max(x for x in kept if x < added)
+            last = min(x for x in kept if x > added)
+            line = get_line_equation_coefficients(points[first], points[last])
+            self.assertEqual(added, max(
+                range(first + 1, last),
+                key=lambda x: abs(line[0] * points[x].latitude + line[1] * points[x].longitude + line[2])))
+            kept = indices
+
+    def test_geocache(self):
+        """GeoCache without network."""
+        with tempfile.TemporaryDirectory() as directory:
+            cache = GeoCache(os.path.join(directory, 'sub', 'geocoder.sqlite'))
+            cache.offline = True
+            self.assertIs(cache.reverse(50.123456, 8.5), GeoCache.failed)
+            self.assertIsNone(cache.forward('Mainz'))
+            self.assertEqual((cache.hits, cache.misses), (0, 2))
+            cache._GeoCache__put('forward:Mainz', [50.0, 8.27, 'Mainz, Germany'])
+            cache._GeoCache__put('reverse:50.1235,8.5', {
+                'fields': {'town': 'Somewhere'}, 'address': 'Street', 'country': 'Germany', 'country_code': 'de'})
+            self.assertEqual(cache.forward('Mainz').address, 'Mainz, Germany')
+            old_shared = GeoCache._GeoCache__shared
+            GeoCache._GeoCache__shared = cache
+            try:
+                gpx = Gpx()
+                gpx.add_points([GPXTrackPoint(50.12349, 8.50001), GPXTrackPoint(51, 9)])
+                self.assertEqual(gpx.locate_point(), ('Somewhere,Germany', True))
+                gpx.default_country = 'germany'
+                self.assertEqual(gpx.locate_point(0, 0, 1), (None, False))
+                self.assertIsNone(gpx.last_point().name)
+            finally:
+                GeoCache._GeoCache__shared = old_shared
+            self.assertEqual((cache.hits, cache.misses), (2, 3))
+            cache.max_entries = 1
+            cache._GeoCache__evict()
+            self.assertIsNone(cache.forward('Mainz'))
+            self.assertEqual(cache.reverse(50.1235, 8.5)['address'], 'Street')
+            cache.max_age = -1
+            self.assertIs(cache.reverse(50.1235, 8.5), GeoCache.failed)
+
+    def test_geocache_forward(self):
+        """GeoCache.forward is cached and throttled like reverse."""
+        asked = list()
+
+        def forward_resolver(place):
+            """Only Mainz is known.
+
+            Returns: [latitude, longitude, address] or None
+
+            """
+            asked.append((place, time.monotonic()))
+            if place == 'Nowhere':
+                return None
+            if place == 'Offline':
+                raise GeoCache.LookupFailed('no network')
+            return [50.0, 8.27, '{}, Germany'.format(place)]
+
+        with tempfile.TemporaryDirectory() as directory:
+            cache = GeoCache(os.path.join(directory, 'geocoder.sqlite'))
+            cache.forward_resolver = forward_resolver
+            cache.min_interval = 0.2
+            self.assertEqual(cache.forward('Mainz').address, 'Mainz, Germany')
+            self.assertIsNone(cache.forward('Nowhere'))
+            self.assertIsNone(cache.forward('Offline'))
+            self.assertEqual(cache.forward('Mainz').address, 'Mainz, Germany')
+            self.assertIsNone(cache.forward('Nowhere'))
+            self.assertIsNone(cache.forward('Offline'))
+            self.assertEqual([x[0] for x in asked], ['Mainz', 'Nowhere', 'Offline', 'Offline'])
+            for first, second in zip(asked, asked[1:]):
+                self.assertGreaterEqual(second[1] - first[1], 0.19)
+
+    def test_geocache_reverse_many(self):
+        """GeoCache.reverse_many with a local resolver."""
+        asked = list()
+
+        def resolver(latitude, longitude):
+            """Water in the south.
+
+            Returns: A place or None
+
+            """
+            asked.append((latitude, longitude))
+            if latitude < 50:
+                return None
+            if latitude > 52:
+                raise GeoCache.LookupFailed('no network')
+            return {
+                'fields': {'village': 'V{}'.format(longitude)}, 'address': None,
+                'country': 'Germany', 'country_code': 'de'}
+
+        with tempfile.TemporaryDirectory() as directory:
+            cache = GeoCache(os.path.join(directory, 'geocoder.sqlite'))
+            cache.resolver = resolver
+            cache.min_interval = 0
+            places = cache.reverse_many([(51, 8), (51.00001, 8.00001), (49, 8), (53, 8), (51, 9)])
+            self.assertEqual(sorted(asked), [(49.0, 8.0), (51.0, 8.0), (51.0, 9.0), (53.0, 8.0)])
+            self.assertEqual(places[0], places[1])
+            self.assertIsNone(places[2])
+            self.assertIs(places[3], GeoCache.failed)
+            self.assertEqual(cache.misses, 4)
+            old_shared = GeoCache._GeoCache__shared
+            GeoCache._GeoCache__shared = cache
+            try:
+                gpx = Gpx()
+                gpx.add_points([GPXTrackPoint(51, 8), GPXTrackPoint(51, 8.5), GPXTrackPoint(49, 9)])
+                gpx.tracks[0].segments.append(mod_gpx.GPXTrackSegment())
+                gpx.tracks[0].segments[1].points.append(GPXTrackPoint(53, 8))
+                gpx.add_segment_waypoints()
+            finally:
+                GeoCache._GeoCache__shared = old_shared
+            self.assertEqual(
+                [x.name for x in gpx.waypoints],
+                ['Trk/Seg 1/1 V8.0,Germany', 'Trk/Seg 1/1 Water', 'Trk/Seg 1/2 ', 'Trk/Seg 1/2 '])
+            self.assertIsNone(gpx.tracks[0].segments[1].points[0].name)
+            self.assertEqual((cache.hits, cache.misses), (1, 6))
+
+    def test_fence_masks(self):
+        """Gpx.fence_masks is cached and extended for appended points."""
+        gpx = Gpx.parse(self.xml)
+        fences = Fences('53.5192692/13.3803910/1000')
+        self.assertEqual([list(x) for x in gpx.fence_masks(fences)], [[True], [False]])
+        self.assertIs(gpx.fence_masks(fences), gpx.fence_masks(fences))
+        self.assertEqual(gpx.fenced_points(fences), 1)
+        self.assertEqual(gpx.fenced_points(Fences(None)), 0)
+        gpx.add_points([GPXTrackPoint(53.5192, 13.38), GPXTrackPoint(54, 13.38)])
+        self.assertEqual([list(x) for x in gpx.fence_masks(fences)], [[True], [False, False, True]])
+        self.assertEqual(gpx.fenced_points(Fences('52.5192692/13.3803910/1000')), 1)
@@ -100,13 +100,28 @@ def repr_timespan(start, end) ->str:
     return '{}:{:02}'.format(hours, minutes)
 
 
-def uniq(lst):
-    """return lst with unique elements."""
-    seen = []
+def uniq(lst, key=None):
+    """return lst with unique elements.
+
+    Args:
+        lst: The elements
+        key: If given, elements with the same key(element) are duplicates. Otherwise
+            they must be equal. Unhashable elements are compared one by one.
+
+    """
+    seen = set()
+    unhashable = []
     for _ in lst:
-        if _ not in seen:
-            seen.append(_)
-            yield _
+        value = _ if key is None else key(_)
+        try:
+            if value in seen:
+                continue
+            seen.add(value)
+        except TypeError:
+            if value in unhashable:
+                continue
+            unhashable.append(value)
+        yield _
 
 
 def remove_directory(path):